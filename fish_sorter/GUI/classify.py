@@ -1,4 +1,3 @@
-import concurrent.futures
 import json
 import logging
 import napari
@@ -19,7 +18,8 @@ from PyQt6.QtCore import (
     QSize,
     Qt,
     QThread,
-    QTimer
+    QTimer,
+    pyqtSignal
 )
 from qtpy.QtGui import QColor, QScreen
 from qtpy.QtWidgets import (
@@ -42,10 +42,19 @@ from skimage import data, draw
 from tifffile import imread
 from typing import List, Optional, Tuple, Callable
 
+from fish_sorter.constants import CLASSIFY_CONFIDENCE, CLASSIFY_TRAINING_DIR
 from fish_sorter.hardware.imaging_plate import ImagingPlate
+from fish_sorter.helpers.classifier import train_classifier
+from fish_sorter.helpers.crops import WellCropCache
+from fish_sorter.helpers.detection import count_objects, fish_orientation, well_features
+from fish_sorter.helpers.mosaic import full_res
+from fish_sorter.helpers.navigation import NavigationIndex
 
 log = logging.getLogger(__name__)
 
+# Fish features set by the fish detection, the classifier never predicts these
+DETECTED_FEATURES = ('lHead',)
+
 class Classify(QObject):
     """Add points layer of the well locations to the image mosaic in napari.
     """
@@ -114,7 +123,7 @@ class Classify(QObject):
         self.points_layer.mode = 'select'
         self.points_layer.events.set_data.connect(self.refresh)
         self.points_layer.events.highlight.connect(self._selected_pt)
-
+        self.viewer.mouse_double_click_callbacks.append(self._clicked_well)
         
         self._key_binding()
         for key, feature in self.key_feature_map.items():
@@ -122,6 +131,10 @@ class Classify(QObject):
             self.points_layer.bind_key(key, overwrite=True)(self._toggle_feature(feature)) # Note: set to overwrite points layer specific shortcuts
         
         self.navigate_all = True
+        self.navigate_uncertain = False
+        self.well_confidence = None
+        self.all_nav = NavigationIndex(range(len(self.pts)))
+        self._rebuild_nav()
         
         # Prevents points from being deleted
         self.viewer.bind_key('Backspace', self._blank, overwrite=True)
@@ -138,9 +151,8 @@ class Classify(QObject):
         self.counter = None
 
         self._create_classify()
-        self.extract_fish(self.pts)
-        self._find_fish_widget(self.pts)
         self._start_async_extraction()
+        self._find_fish_widget(self.pts)
 
         self.prefix = prefix
         self.expt_dir = expt_dir
@@ -214,6 +226,16 @@ class Classify(QObject):
         finally:
             self._handling_select = False
 
+    def _clicked_well(self, viewer, event):
+        """Callback when the mosaic is double clicked, goes to the well under the cursor
+        so wells can be picked anywhere inside them instead of only on their center point
+        """
+
+        row, col = self.points_layer.world_to_data(event.position)[-2:]
+        well_id = self.iplate.find_well_ids([[col, row]])[0]
+        if well_id >= 0 and well_id != self.current_well:
+            QTimer.singleShot(0, lambda i=int(well_id): self._goto_well(i))
+
     def _selected_current_pt(self):
         """Select the point for the current well in the points layer
         """
@@ -261,6 +283,7 @@ class Classify(QObject):
                 for feat in self.deselect_rules.get('empty', []):
                     self.points_layer.features.loc[selected_points, feat] = False
 
+            self.singlet_nav.update(selected_points, self.points_layer.features.loc[selected_points, 'singlet'])
             self._update_counter()                   
             self.points_layer.refresh_colors(update_color_mapping=False)
             self._update_feature_display(self.current_well)
@@ -318,6 +341,11 @@ class Classify(QObject):
             classified = os.path.normpath(os.path.join(self.expt_dir, file_name))
             class_df.to_csv(classified, index=False)
             logging.info(f'Classification saved as {classified}')
+
+            if getattr(self, 'well_table', None) is not None:
+                feature_file = os.path.normpath(os.path.join(self.expt_dir, f"{timestamp}_{self.prefix}_features.npy"))
+                np.save(feature_file, self.well_table)
+                logging.info(f'Well features saved as {feature_file}')
             
         self.class_btn.clicked.connect(_save_it)
     
@@ -368,16 +396,6 @@ class Classify(QObject):
         finally:
             self._refreshing = False
 
-    def extract_fish(self, points):
-        """Finds the locations of positive wells
-
-        :param points: x, y coords for center location defining the well locations in the points layer
-        :type points: numpy points
-        """
-        
-        self._well_mask()
-        self.well_extract = self._extract_wells(points)
-    
     def _well_mask(self, padding: int=100):
         """Create a mask of the well shape
 
@@ -407,136 +425,50 @@ class Classify(QObject):
         self.mask[rr, cc] = True
     
     def _start_async_extraction(self):
-        """Thread for well extraction
-        """
+        """Sets up the on demand well crop cache
 
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-        self.future = self.executor.submit(self._extract_wells_threaded)
-        self.future.add_done_callback(self._extract_done)
-
-    def _extract_done(self, future):
-        """Callback to main thread after background well extraction is done
-        """
-
-        try:
-            self.well_extract = future.result()
-            self._well_disp()
-        except Exception as e:
-            logging.error(f'Well extraction failed: {e}')
-
-    def _extract_wells_threaded(self):
-        """Background thread for well extractraion
+        Wells are cropped when displayed and kept in a bounded LRU cache, and the wells
+        next to the current one in navigation order are cropped ahead in the background
         """
 
-        points = self._points()
         self._well_mask()
-        return self._extract_wells(points, img_flag=True, parallel=True)
-    
-    def _extract_wells(self, points, img_flag: bool=True, mask_layer: str=None, parallel: bool=False, sigma: float=0.25) -> dict:
-        """Cuts a well centered around the points in the points layer of the image
-        of the size defined in the array and displays the image layer
+        images = {
+            layer.name: full_res(layer)
+            for layer in self.viewer.layers
+            if isinstance(layer, napari.layers.Image)
+        }
+        self.well_extract = WellCropCache(images, self._points(), self.mask)
+        self._prefetch_wells()
+        self._well_disp()
 
-        :param points: array of (y, x) coordinates (row, col) for well centers
-        :type points: numpy points
-        :param img_flag: option whether to use the image layers or to create the binary image mask 
-            automatic fish detection, True to use the image layers, False to use the binary mask
-        :type img_flag: bool 
-        :param mask_layer: layer to use to find fish, default None will use all layers
-        :type layer_name: str
-        :param parallel: whether to use parallel processing
-        :type parallel: bool
-        :param sigma: number of standard deviations from mean for thresholding the mask
-        :type sigma: float
+    def _prefetch_wells(self, count: int=2):
+        """Crops the wells around the current well in navigation order in the background
 
-        :return: layer name, extracted region for each layer for each point
-        :rtype: dict 
+        :param count: number of wells to prefetch in each direction
+        :type count: int
         """
 
-        mask_height, mask_width = self.mask.shape
-        half_mask_height, half_mask_width = mask_height // 2, mask_width // 2
-
-        if img_flag:
-            image_layers = [
-                {'data': layer.data, 'name': layer.name} 
-                for layer in self.viewer.layers 
-                if isinstance(layer, napari.layers.Image)
-            ]
-        else:
-            if mask_layer:
-                raw_layers = [layer for layer in self.viewer.layers if layer.name == mask_layer]
-                raw_data = raw_layers[0].data
-                layer_name = raw_layers[0].name
-            else:
-                raw_layers = [
-                    layer for layer in self.viewer.layers 
-                    if isinstance(layer, napari.layers.Image) and layer.name != 'BF'
-                ]
-                raw_data = np.zeros_like(raw_layers[0].data, dtype=np.uint16)
-                for layer in raw_layers:
-                    logging.info(f'layer name {layer}')
-                    raw_data += layer.data
-                layer_name = 'sum'
-            mask_mean = raw_data.mean()
-            mask_std = raw_data.std()
-            thresh = mask_mean + (sigma * mask_std)
-            binary_mask = raw_data > thresh
-            image_layers = [{'data': binary_mask.astype(np.uint8), 'name': layer_name}]
-            logging.info(f'image layers {layer_name}')
-    
-        def _extract_point(point):
-            """Creates extracted image around points
-
-            :param point: (y, x) coordinate (row, col) for well center
-            :type point: float
+        if getattr(self, 'well_extract', None) is None:
+            return
 
-            :return region_by_layer, extracted region for each layer for each point
-            :rtype: dict
-            """
+        index = self._nav_index()
+        if len(index) == 0:
+            return
+        ahead, behind = [], []
+        for _ in range(count):
+            ahead.append(index.next(ahead[-1] if ahead else self.current_well))
+            behind.append(index.previous(behind[-1] if behind else self.current_well))
+        self.well_extract.prefetch([w for pair in zip(ahead, behind) for w in pair])
 
-            width_center, height_center  = int(point[1]), int(point[0])
-            region_by_layer = {}
-
-            for layer in image_layers:
-                img_data = layer['data']
-                layer_name = layer['name']
-                width_min = max(width_center - half_mask_width, 0)
-                width_max = min(width_center + half_mask_width, img_data.shape[1])
-                height_min = max(height_center - half_mask_height, 0)
-                height_max = min(height_center + half_mask_height, img_data.shape[0])
-                region = img_data[height_min : height_max, width_min : width_max]
-
-                mask_height_min = max(0, height_min - (height_center - half_mask_height))
-                mask_height_max = mask_height_min + region.shape[0]
-                mask_width_min = max(0, width_min - (width_center - half_mask_width))
-                mask_width_max = mask_width_min + region.shape[1]
-
-                mask_width_max = min(mask_width, mask_width_max)
-                mask_height_max = min(mask_height, mask_height_max)
-            
-                overlap_width = mask_width_max - mask_width_min
-                overlap_height = mask_height_max - mask_height_min
-            
-                if overlap_width > 0 and overlap_height > 0:
-                    masked_region = np.zeros_like(region)
-                    masked_region[:overlap_height, :overlap_width] = (
-                        region[:overlap_height, :overlap_width] * self.mask[mask_height_min:mask_height_max, mask_width_min:mask_width_max]
-                    )
-                    region_by_layer[layer['name']] = masked_region
-                else:
-                    logging.info(f'Skipping point at ({point[0]}, {point[1]}) due to zero overlap dimensions')
-   
-            return region_by_layer
-
-        if parallel:
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                results = list(pool.map(_extract_point, points))
-            return results
-        else:
-            return [_extract_point(p) for p in points]
-    
     def find_fish(self, points, layer_name=None, sigma=0.25):
         """Automatically detects fish and fish orientation.
 
+        Fish are found from the area above threshold in the per well feature table, for the layer
+        or the sum of the non BF layers. The table has one row per well, in the order of the points
+        layer features, and a '<layer>_<feature>' column for every layer and feature in WELL_FEATURES,
+        and for the sum of the non BF layers whichever layer is used. It is computed in a worker thread
+        and the wells are classified when it is done
+
         :param points: x, y coordinates for center location points defining the well locations
         :type points: numpy points
 
@@ -547,89 +479,224 @@ class Classify(QObject):
         :type simga: float
         """
 
-        img_data = self._extract_wells(points, img_flag=False, mask_layer=layer_name, parallel=True, sigma=sigma)
-        wells_data = [list(region.values())[0].mean() for region in img_data]
+        detect = layer_name if layer_name else 'sum'
+        groups = {
+            layer.name: [full_res(layer)]
+            for layer in self.viewer.layers
+            if isinstance(layer, napari.layers.Image)
+        }
+        fluorescence = [images[0] for name, images in groups.items() if name != 'BF']
+        if fluorescence:
+            groups['sum'] = fluorescence
+        if not groups.get(detect):
+            logging.info(f'No image layers to find fish in')
+            return
+
+        if getattr(self, 'find_thread', None) is not None and self.find_thread.isRunning():
+            logging.info('Still finding fish')
+            return
+
+        # The batched passes over every well run in a worker thread, the GUI is updated when they are done
+        self._well_mask()
+        mask = self.mask.copy()
+        labels = (
+            [feature for feature in self.well_feat if feature != 'deselect'],
+            [feature for feature in self.fish_feat if feature not in DETECTED_FEATURES],
+        )
+        well_names = list(self.iplate.wells["names"])
+        orient = self.iplate.px_sz_um if self.picking == 'larvae' else None
+        self.find_thread = FindFishThread(
+            lambda: self._detect_fish(points, groups, mask, detect, layer_name, sigma, orient, labels, well_names)
+        )
+        self.find_thread.status_update.connect(lambda msg: logging.info(msg))
+        self.find_thread.detection_done.connect(self._fish_detected)
+        self.find_thread.start()
+
+    def _detect_fish(self, points, groups: dict, mask, detect: str, layer_name, sigma: float, orient, labels, well_names) -> dict:
+        """Finds the fish in every well, run in the worker thread so it only reads its arguments
+
+        Wells with fish are those above the mean area over threshold, or below it in BF. Outside of BF
+        the objects are counted too, and of the wells with fish the singlets are those with exactly one
+        object and the multiples those with more. The orientation of the singlets is computed when orient
+        is given, and the classifier trained on the saved classifications of this pick type predicts the
+        remaining labels when CLASSIFY_TRAINING_DIR is set
+
+        :param orient: pixel size [um] to find the fish orientation with, None to skip
+        :type orient: float
+        :param labels: well labels and fish feature labels of the pick type
+        :type labels: tuple of list
+        :param well_names: name of each well in plate order, to match the saved classifications to the features
+        :type well_names: list of str
+
+        :return: feature table, singlets, multiples, counts and objects, orientation and predictions
+        :rtype: dict
+        """
+
+        result = {'table': well_features(groups, points, mask, sigma), 'multiples': None, 'counts': None,
+                  'objects': None, 'orientation': None, 'prediction': None}
+        wells_data = result['table'][f'{detect}_area']
         well_mean = np.mean(wells_data)
         if layer_name == 'BF':
-            well_class = [region_mean < well_mean for region_mean in wells_data]
+            fish = wells_data < well_mean
         else:
-            well_class = [region_mean > well_mean for region_mean in wells_data]
+            fish = wells_data > well_mean
+        result['singlets'] = fish
+
+        # Fish are bright on a dark background except in BF, so only count objects in fluorescence
+        if layer_name != 'BF':
+            result['counts'], result['objects'] = count_objects(groups[detect], points, mask, sigma)
+            result['singlets'] = fish & (result['counts'] == 1)
+            result['multiples'] = fish & (result['counts'] > 1)
+
+        if orient is not None:
+            if 'sum' in groups:
+                result['orientation'] = self.orient_fish(result['table'], np.flatnonzero(result['singlets']), orient)
+            else:
+                logging.info('No fluorescence layers to find the fish orientation in')
+
+        if CLASSIFY_TRAINING_DIR is not None:
+            classifier = train_classifier(CLASSIFY_TRAINING_DIR, self.picking, *labels, well_names)
+            if classifier is not None:
+                result['prediction'] = classifier.predict(result['table'])
+
+        return result
+
+    def _fish_detected(self, result: dict):
+        """Classifies the wells once the worker thread found the fish
+
+        :param result: from _detect_fish, None if it failed
+        :type result: dict
+        """
+
+        if result is None:
+            return
+        self.well_table = result['table']
+        logging.info(f'Computed {len(self.well_table.dtype.names)} features for {len(self.well_table)} wells')
+        if result['counts'] is not None:
+            self.well_counts, self.well_objects = result['counts'], result['objects']
+            logging.info(f'Counted {int(result["singlets"].sum())} singlets and {int(result["multiples"].sum())} multiples')
 
         self.navigate_all = False
-        self._update_found_fish(well_class)
+        self._update_found_fish(result['singlets'], result['multiples'], result['orientation'])
+        if result['prediction'] is not None:
+            self.preclassify(*result['prediction'])
+
+    def preclassify(self, predictions: dict, confidence):
+        """Pre-fills the fish feature classifications of the singlets from the classifier predictions,
+        and switches to navigating the wells the classifier is not confident about
+
+        The well classes and the features in DETECTED_FEATURES stay as found by the detection
+
+        :param predictions: label name to predicted bool per well, from WellClassifier.predict
+        :type predictions: dict
+        :param confidence: confidence of each well in [0, 1]
+        :type confidence: np.ndarray
+        """
+
+        singlets = self.points_layer.features['singlet'].to_numpy(dtype=bool)
+        for label in self.fish_feat:
+            if label in predictions and label not in DETECTED_FEATURES:
+                self.points_layer.features.loc[singlets, label] = predictions[label][singlets]
+        self.well_confidence = confidence
+        logging.info(f'Pre-classified {len(self.well_confidence)} wells, {int((self.well_confidence < CLASSIFY_CONFIDENCE).sum())} with low confidence')
+
+        self.navigate_uncertain = True
+        self._rebuild_nav()
+        self.refresh()
+        self.points_layer.mode = 'select'
+        first = self._nav_index().first()
+        self.current_well = int(first) if first is not None else 0
+        self._update_nav_mode()
+        self._goto_well(self.current_well)
 
     def _reset_fish(self):
         """Resets the found fish to the empty state and deselects all classifications
         """
 
         self.navigate_all = True
+        self.navigate_uncertain = False
+        self.well_confidence = None
         self._feat()
         for feat in self.features:
             self.points_layer.features[feat] = self.features[feat]
+        self.points_layer.features.drop(columns=['bodyX_um', 'bodyY_um', 'bodyAngle'], errors='ignore', inplace=True)
+        self._rebuild_nav()
         self.refresh()
         self._update_counter()
         self._update_nav_mode()
     
-    def _update_found_fish(self, wells: List[int]):
+    def _update_found_fish(self, wells: List[int], multiples: List[bool]=None, orientation: tuple=None):
         """Updates the feature classification for the found fish and orientation
 
         :param wells: well locations with fish
         :type wells: List[int]
+        :param multiples: well locations with more than one fish
+        :type multiples: List[bool]
+        :param orientation: head side and body position of the singlets from orient_fish
+        :type orientation: tuple
         """
 
+        if multiples is not None and 'multiple' in self.points_layer.features:
+            multiples = np.asarray(multiples, dtype=bool)
+            self.points_layer.features.loc[multiples, 'multiple'] = True
+            for feat in self.deselect_rules['multiple']:
+                self.points_layer.features.loc[multiples, feat] = False
+
         singlets = self.points_layer.features['singlet']
         singlets.loc[wells] = True
-        singlets_idxs = np.where(singlets)[0]
         self.points_layer.features.loc[:, 'singlet'] = singlets
         for feat in self.deselect_rules['singlet']:
             self.points_layer.features.loc[singlets, feat] = False                                 
+        self._rebuild_nav()
         self.refresh()
         self.points_layer.mode = 'select'
-        self.current_well = int(singlets_idxs[0])
+        if len(self.singlet_nav) == 0:
+            logging.info('No singlets found')
+            self._update_nav_mode()
+            return
+        self.current_well = int(self.singlet_nav.first())
 
-        if self.picking == 'larvae':
-            logging.info('Determining fish orientation for picking larvae')
-            self.find_orientation()
+        if orientation is not None:
+            self._update_orientation(*orientation)
+            # self.plot_crop() #Toggle for crop debugging
     
         self._update_nav_mode()
         self._goto_well(self.current_well)
 
-    def find_orientation(self):
-        """Determines orientation to select side of well for picking
+    @staticmethod
+    def orient_fish(table, wells, px_sz_um: float, group: str='sum'):
+        """Determines the head side and body position of fish to select the side of the well for picking
+
+        The orientation of all of the wells is taken from the image moments of the well feature table
+
+        :param table: well feature table from well_features
+        :type table: np.ndarray
+        :param wells: indices of the wells to orient, e.g. the singlets
+        :type wells: np.ndarray
+        :param px_sz_um: pixel size [um]
+        :type px_sz_um: float
+        :param group: feature group of the table to orient the fish with, the fish must be bright in it
+        :type group: str
+
+        :return: well to head on the left, and column name to well to the body center offset [um] or angle [deg]
+        :rtype: dict, dict
         """
 
-        single = [i for i, val in enumerate(self.points_layer.features['singlet']) if val]
+        skipped = wells[wells >= len(table)]
+        if len(skipped):
+            logging.info(f'Skipping fish {list(skipped)}: out of bounds for well extraction')
+        wells = wells[wells < len(table)]
 
-        def comp_orientation(fish):
-            """Helper to parallelize orienataion computation
-            """
+        fish = fish_orientation(table[wells], group)
+        orientation = {int(well): bool(head) for well, head in zip(wells, fish['lhead'])}
+        body = {
+            'bodyX_um': {int(well): x * px_sz_um for well, x in zip(wells, fish['cx'])},
+            'bodyY_um': {int(well): y * px_sz_um for well, y in zip(wells, fish['cy'])},
+            'bodyAngle': {int(well): np.rad2deg(angle) for well, angle in zip(wells, fish['angle'])},
+        }
+
+        return orientation, body
 
-            if fish >= len(self.well_extract):
-                logging.info(f'Skipping fish {fish}: out of bounds for well extraction')
-                return fish, None
-            well_data = self.well_extract[fish]
-            channels = list(well_data.values())
-            well_total = np.zeros_like(channels[0], dtype=np.float32)
-            for channel in channels:
-                well_total += channel
-            well_total /= len(channels)
-
-            height, width = well_total.shape
-            half_width = width // 2
-            left = well_total[:height, :half_width]
-            right = well_total[:height, half_width:width]
-
-            left_sum = np.sum(left)
-            right_sum = np.sum(right)
-
-            return fish, left_sum >= right_sum
-
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            results = list(pool.map(comp_orientation, single))
-        orientation = {fish: head for fish, head in results if head is not None}
-        self._update_orientation(orientation)
-        # self.plot_crop() #Toggle for crop debugging
-    
     def plot_crop(self):
         """Plots the cropped images for debugging
         """
@@ -639,7 +706,7 @@ class Classify(QObject):
         for idx in single:
             if idx >= len(self.well_extract):
                 continue
-            well_data = self.well_extract[idx]
+            well_data = self.well_extract.get(idx, cache=False)
             channels = list(well_data.values())
 
             if not channels:
@@ -665,15 +732,23 @@ class Classify(QObject):
                 ax.axis('off')
             plt.show()
     
-    def _update_orientation(self, orientation=List[int]):
+    def _update_orientation(self, orientation=List[int], body: dict=None):
         """Updates the feature classification for the found fish and orientation
 
         :param orientation: well location where fish orientation is True
         :type orientation: List[int]
+        :param body: column name to well location to the body center offset from the well center [um]
+            or body angle [deg], saved with the classification for picking
+        :type body: dict
         """
 
         for idx, head in orientation.items():
             self.points_layer.features.loc[idx, 'lHead'] = head
+        for column, values in (body or {}).items():
+            if column not in self.points_layer.features:
+                self.points_layer.features[column] = np.nan
+            for idx, value in values.items():
+                self.points_layer.features.loc[idx, column] = value
         self.refresh()
         self.points_layer.mode = 'select'
         logging.info('Ready for individual fish classification')
@@ -746,6 +821,7 @@ class Classify(QObject):
         self.viewer.bind_key("Right", self._next_well, overwrite=True)
         self.viewer.bind_key("Left", self._previous_well, overwrite=True)
         self.viewer.bind_key("T", self._toggle_navigation, overwrite=True)
+        self.viewer.bind_key("C", self._toggle_uncertain, overwrite=True)
 
         self._update_counter()
         self._update_nav_mode()
@@ -831,6 +907,7 @@ class Classify(QObject):
         self._well_disp()
         self._update_feature_display(self.current_well)
         self._update_counter()
+        self._prefetch_wells()
 
         QTimer.singleShot(0, self._refocus_viewer)
         QTimer.singleShot(0, self.viewer.window._qt_window.activateWindow)
@@ -838,6 +915,30 @@ class Classify(QObject):
         QTimer.singleShot(0, self.viewer.window._qt_window.setFocus)
 
     
+    def _rebuild_nav(self):
+        """Rebuilds the singlet and low confidence navigation indices after wells are classified in bulk
+
+        Single well classifications update the singlet index incrementally in _toggle_feature
+        """
+
+        self.singlet_nav = NavigationIndex.from_mask(self.points_layer.features['singlet'])
+        if self.well_confidence is not None:
+            self.uncertain_nav = NavigationIndex.from_mask(self.well_confidence < CLASSIFY_CONFIDENCE)
+        else:
+            self.uncertain_nav = NavigationIndex()
+
+    def _nav_index(self) -> NavigationIndex:
+        """Wells visited by the left and right arrow keys in the current navigation mode
+
+        :return: sorted well indices
+        :rtype: NavigationIndex
+        """
+
+        if self.navigate_uncertain and self.well_confidence is not None:
+            return self.uncertain_nav
+
+        return self.all_nav if self.navigate_all else self.singlet_nav
+
     def _next_well(self, event=None):
         """Updates the viewer window with the next well when the right arrow key is pressed
 
@@ -845,19 +946,18 @@ class Classify(QObject):
         :type event: Event of Napari Qt Event loop
         """
 
-        idxs = np.arange(len(self.points_layer.data)) if self.navigate_all else np.where(self.points_layer.features['singlet'])[0]
+        index = self._nav_index()
 
-        if len(idxs) == 0:
+        if len(index) == 0:
             logging.info(f'No wells were found under the current navigation mode')
             return
 
-        try:
-            current_idx = np.where(idxs == self.current_well)[0][0]
-            next_idx = (current_idx + 1) % len(idxs)
-        except IndexError:
-            next_idx = 0
+        if self.current_well in index:
+            next_well = index.next(self.current_well)
+        else:
+            next_well = index.first()
             
-        self._goto_well(idxs[next_idx])
+        self._goto_well(next_well)
     
     def _previous_well(self, event=None):
         """Updates the viewer window with the previous well when the left arrow key is pressed
@@ -866,19 +966,18 @@ class Classify(QObject):
         :type event: Event of Napari Qt Event loop
         """
 
-        idxs = np.arange(len(self.points_layer.data)) if self.navigate_all else np.where(self.points_layer.features['singlet'])[0]
+        index = self._nav_index()
 
-        if len(idxs) == 0:
+        if len(index) == 0:
             logging.info(f'No wells were found under the current navigation mode')
             return
 
-        try:
-            current_idx = np.where(idxs == self.current_well)[0][0]
-            prev_idx = (current_idx - 1 + len(idxs)) % len(idxs)
-        except IndexError:
-            prev_idx = len(idxs) - 1
+        if self.current_well in index:
+            prev_well = index.previous(self.current_well)
+        else:
+            prev_well = index.last()
 
-        self._goto_well(idxs[prev_idx])
+        self._goto_well(prev_well)
 
     def _toggle_navigation(self, event=None):
         """Changes left right navigation from singlets to all fish
@@ -887,61 +986,78 @@ class Classify(QObject):
         :type event: Event of Napari Qt Event loop
         """
 
+        self.navigate_uncertain = False
         self.navigate_all = not self.navigate_all
         mode = 'All' if self.navigate_all else 'Singlets'
         logging.info(f'Well navigation set to {mode}')
         self._update_counter()
         self._update_nav_mode()
 
+    def _toggle_uncertain(self, event=None):
+        """Changes left right navigation to and from the wells with low pre-classification confidence
+
+        :param event: key press of C
+        :type event: Event of Napari Qt Event loop
+        """
+
+        if self.well_confidence is None:
+            logging.info('No pre-classification confidence, run Find Fish with saved classifications first')
+            return
+
+        self.navigate_uncertain = not self.navigate_uncertain
+        logging.info(f'Low confidence well navigation {"on" if self.navigate_uncertain else "off"}')
+        self._update_counter()
+        self._update_nav_mode()
+
     def _update_counter(self):
         """Updates the fish counter for the user to know which fish they are on and the total
         """
 
-        if self.navigate_all:
+        if self.navigate_uncertain and self.well_confidence is not None:
+            if len(self.uncertain_nav) == 0:
+                self.counter.setText('No Uncertain Wells')
+                return
+            pos = max(self.uncertain_nav.position(self.current_well), 0) + 1
+            self.counter.setText(f'Uncertain {pos} of {len(self.uncertain_nav)}')
+
+        elif self.navigate_all:
             total = len(self.points_layer.data)
             pos = self.current_well + 1
             self.counter.setText(f'Well {pos} of {total} (All Wells)')
 
         else:
         
-            singlets = self.points_layer.features['singlet']
-            singlet_idxs = np.where(singlets)[0]
-
-            if len(singlet_idxs) == 0:
+            if len(self.singlet_nav) == 0:
                 self.counter.setText('No Fish')
                 return
 
-            try:
-                pos = np.where(singlet_idxs == self.current_well)[0][0] + 1
-
-            except IndexError:
-                pos = 1
-        
-            total = len(singlet_idxs)
+            pos = max(self.singlet_nav.position(self.current_well), 0) + 1
+            total = len(self.singlet_nav)
             self.counter.setText(f'Fish {pos} of {total}')
     
     def _update_nav_mode(self):
         """GUI navigate mode indicator
         """
 
-        mode = 'All Wells' if self.navigate_all else 'Singlets'
-        self.nav_mode_label.setText(f'Nav Mode <b>{mode} </b/> &nbsp; (press <b>T</b> to toggle)')
+        if self.navigate_uncertain and self.well_confidence is not None:
+            mode = 'Low Confidence'
+        else:
+            mode = 'All Wells' if self.navigate_all else 'Singlets'
+        self.nav_mode_label.setText(f'Nav Mode <b>{mode} </b/> &nbsp; (press <b>T</b> to toggle, <b>C</b> for low confidence)')
 
     def _singlet_nav(self):
         """Helper function during singlet navigation mode when a fish is reclassified as not a singlet
         Does not reset the curret well to 0
         """
 
-        if self.navigate_all:
+        if self.navigate_all or self.navigate_uncertain:
             return
 
-        singlet_idxs = np.where(self.points_layer.features['singlet'])[0]
-        if len(singlet_idxs) == 0:
+        if len(self.singlet_nav) == 0:
             return
 
-        if self.current_well not in singlet_idxs:
-            next_well = singlet_idxs[singlet_idxs > self.current_well]
-            next_singlet = next_well[0] if len(next_well) > 0 else singlet_idxs[0]
+        if self.current_well not in self.singlet_nav:
+            next_singlet = self.singlet_nav.next(self.current_well)
             if next_singlet != self.current_well:
                 QTimer.singleShot(0, lambda i=int(next_singlet): self._goto_well(i))
     
@@ -1026,6 +1142,8 @@ class Classify(QObject):
                     self.points_layer.events.highlight.disconnect(self._selected_pt)
                 except Exception:
                     pass
+            if self._clicked_well in self.viewer.mouse_double_click_callbacks:
+                self.viewer.mouse_double_click_callbacks.remove(self._clicked_well)
             if getattr(self, 'contrast_callbacks', None):
                 for layer_name, cb in list(self.contrast_callbacks.items()):
                     main_layer = self._get_main_layer(layer_name)
@@ -1036,11 +1154,10 @@ class Classify(QObject):
                             pass
                 self.contrast_callbacks.clear()
 
-            if getattr(self, 'executor', None) is not None:
-                try:
-                    self.executor.shutdown(wait=False, cancel_futures=True)
-                except TypeError:
-                    self.executor.shutdown(wait=False)
+            if getattr(self, 'find_thread', None) is not None:
+                self.find_thread.wait()
+            if getattr(self, 'well_extract', None) is not None:
+                self.well_extract.shutdown()
         except Exception as e:
             logging.info(f'Classify cleanup exception: {e}')
 
@@ -1074,6 +1191,33 @@ class QtViewerWrap(QtViewer):
             filenames, stack, plugin, layer_type, **kwargs
         )
 
+class FindFishThread(QThread):
+    """Runs the per well detection passes so the viewer stays responsive while fish are found
+    """
+
+    status_update = pyqtSignal(str)
+    detection_done = pyqtSignal(object)
+
+    def __init__(self, detect, parent=None):
+        """
+        :param detect: called in the thread, its result is emitted with detection_done
+        :type detect: Callable
+        """
+
+        super().__init__(parent=parent)
+        self.detect = detect
+
+    def run(self):
+
+        result = None
+        try:
+            result = self.detect()
+        except Exception as e:
+            self.status_update.emit(f'Exception finding fish {str(e)}')
+        finally:
+            self.detection_done.emit(result)
+
+
 class FishFinderWidget(QWidget):
     """Widget to setup the fish finding algorithm and run it to determine
     the well locations with fish
@@ -1200,7 +1344,7 @@ class ContrastWidget(QWidget):
 
     def update_contrast(self, layer, slider_value, scale):
         n_sigma = slider_value / scale
-        data = layer.data
+        data = full_res(layer)
         mean = np.mean(data)
         std = np.std(data)
         lower = mean - n_sigma * std
@@ -18,11 +18,10 @@ from qtpy.QtWidgets import (
     QWidget
 )
 from qtpy.QtCore import Qt, QTimer
-from tifffile import imwrite
 from typing import overload
 from useq import GridFromEdges, MDASequence
 
-from fish_sorter.constants import CAM_PX_UM, CAM_X_PX, CAM_Y_PX
+from fish_sorter.constants import CAM_PX_UM, CAM_X_PX, CAM_Y_PX, FLATFIELD_CORRECT, LAZY_MOSAIC, REGISTER_TILES
 from fish_sorter.GUI.classify import Classify
 from fish_sorter.GUI.image_gui import ImageWidget
 from fish_sorter.GUI.picking import Pick
@@ -31,7 +30,9 @@ from fish_sorter.GUI.selection_gui import SelectGUI
 from fish_sorter.GUI.setup_gui import SetupWidget
 from fish_sorter.hardware.imaging_plate import ImagingPlate
 from fish_sorter.hardware.picking_pipette import PickingPipette
-from fish_sorter.helpers.mosaic import Mosaic
+from fish_sorter.helpers.calibration_store import CalibrationStore
+from fish_sorter.helpers.mosaic import Mosaic, StreamingMosaic
+from fish_sorter.helpers.mosaic_io import MosaicWriter
 from fish_sorter.logger_setup import setup_logger
 from fish_sorter.paths import MM_DIR
 
@@ -95,6 +96,21 @@ class FishSorter:
         self.main_window._show_dock_widget("MDA")
 
         napari.run()
+        self.close()
+
+    def close(self):
+        """Stops the background threads once the viewer is closed, finishing any mosaic still being saved
+        """
+
+        if self.use_stream:
+            self.stream.disconnect()
+        if getattr(self, 'classify', None) is not None:
+            try:
+                self.classify.cleanup()
+            except Exception as e:
+                logging.info(f'Classify cleanup failed on close: {e}')
+        self.writer.shutdown(wait=True)
+        logging.info('Closed the fish sorter')
 
     def assign_widgets(self):
         
@@ -116,6 +132,13 @@ class FishSorter:
         """
 
         self.mosaic = Mosaic(self.v)
+        # The streamed mosaic uses raw tiles at nominal positions, so it is only used when the tiles are stitched as is
+        self.use_stream = not (LAZY_MOSAIC or REGISTER_TILES or FLATFIELD_CORRECT)
+        self.stream = StreamingMosaic(self.core)
+        if self.use_stream:
+            self.stream.connect()
+        self.writer = MosaicWriter()
+        self.calib_store = CalibrationStore()
         self.mda = None
 
         # Image Manipulation Widget
@@ -129,6 +152,9 @@ class FishSorter:
 
         self.img_tools.mosaic_btn.clicked.connect(self.run)
         self.img_tools.class_btn.clicked.connect(self.run_class)
+        self.img_tools.flat_btn.clicked.connect(lambda: self.calibrate_flatfield())
+        self.img_tools.fid_btn.clicked.connect(self.add_fiducial)
+        self.img_tools.fid_clear_btn.clicked.connect(self.clear_fiducials)
         self.core.events.pixelSizeChanged.connect(self.main_mag)
 
         self.main_mag()
@@ -143,6 +169,58 @@ class FishSorter:
         if 'crosshairs' in self.v.layers:
             self.img_tools._create_crosshairs()
 
+    def calibrate_flatfield(self, n_frames: int=8):
+        """Measures the flat-field and dark frame of the current channel and objective, used to
+        correct the tiles when FLATFIELD_CORRECT is set
+
+        The flat frames are snapped at the current position, which should show a uniform sample
+        such as a fluorescent slide, and the dark frames with the shutter closed
+
+        :param n_frames: frames averaged for each of the flat and dark frame
+        :type n_frames: int
+        """
+
+        self.main_mag()
+        chan_config = self.core.getCurrentConfig(self.core.getChannelGroup())
+        logging.info(f'Calibrating the {chan_config} flat-field for {self.img_tools.objective}')
+
+        flat_frames = np.stack([self.core.snap() for _ in range(n_frames)])
+        auto_shutter = self.core.getAutoShutter()
+        try:
+            self.core.setAutoShutter(False)
+            self.core.setShutterOpen(False)
+            dark_frames = np.stack([self.core.snap() for _ in range(n_frames)])
+        finally:
+            self.core.setAutoShutter(auto_shutter)
+
+        self.mosaic.flatfield.calibrate(chan_config, self.img_tools.objective, flat_frames, dark_frames)
+        logging.info(f'Saved the {chan_config} flat-field to {self.mosaic.flatfield.cache_dir}')
+
+    def add_fiducial(self):
+        """Records the current stage position as the measured center of the well named in the image widget,
+        with 3 or more fiducials the plate calibration is a least squares affine instead of the corner fit
+        """
+
+        if getattr(self, 'iplate', None) is None:
+            logging.warning('Setup the picker before adding fiducials')
+            return
+        well = self.img_tools.fid_well.text().strip()
+        if well not in list(self.iplate.well_names):
+            logging.warning(f'Fiducial well {well} is not on the plate')
+            return
+
+        pos = np.array([self.core.getXPosition(), self.core.getYPosition()])
+        self.iplate.add_fiducial(well, pos)
+        logging.info(f'Added fiducial {well} at {pos}, {len(self.iplate.fiducials)} fiducials')
+
+    def clear_fiducials(self):
+        """Removes the fiducials so the plate is calibrated from the grid corners again
+        """
+
+        if getattr(self, 'iplate', None) is not None:
+            self.iplate.clear_fiducials()
+            logging.info('Cleared fiducials')
+
     def run_class(self):
         """Classification GUI startup from image widget class_btn
         """
@@ -187,8 +265,22 @@ class FishSorter:
         sequence = self.mda.value()
         mosaic_metadata = self.mosaic.get_mosaic_metadata(sequence)
 
-        self.iplate.set_calib_pts()
-        self.iplate.load_wells(grid_list=self.mosaic.grid_list)
+        # Reuse the calibration of this plate, objective and grid if it was already computed
+        calib_key = self.calib_store.key(
+            self.iplate.array_file,
+            self.img_tools.objective,
+            sequence.grid_plan,
+            self.iplate.px_sz_um,
+            sorted((name, pos.tolist()) for name, pos in self.iplate.fiducials.items()),
+        )
+        calib_state = self.calib_store.get(calib_key)
+        if calib_state is not None:
+            logging.info('Using stored plate calibration')
+            self.iplate.restore_calibration(calib_state)
+        else:
+            self.iplate.set_calib_pts()
+            self.iplate.load_wells(grid_list=self.mosaic.grid_list)
+            self.calib_store.put(calib_key, self.iplate.calibration_state())
 
         self.classify = Classify(self.cfg_dir, self.pick_type, self.expt_prefix, self.expt_path, self.iplate, self.v)
         self.v.reset_view()
@@ -217,6 +309,8 @@ class FishSorter:
         mda = self.mda.value()
         logging.info(f'Saving MDA sequence: {mda} to {settings_path}')
         self.mda.save(settings_path)
+        self.calib_store.store_dir = Path(self.expt_path) / f'{self.expt_prefix}_calibration'
+        self.mosaic.registration.cache_dir = Path(self.expt_path) / f'{self.expt_prefix}_registration'
 
         self.img_array = self.setup.get_img_array()
         self.dp_array = self.setup.get_dp_array()
@@ -305,13 +399,26 @@ class FishSorter:
         """
 
         sequence = self.mda.value()
-        img_arr = self.main_window._core_link._mda_handler._tmp_arrays
-        self.stitch = self.mosaic.stitch_mosaic(sequence, img_arr)
+        if LAZY_MOSAIC:
+            logging.info('Viewing the acquired tiles as a lazy mosaic')
+            self.stitch = None
+            # The tiles are read before any mosaic layer is added on top of them
+            tiles = self.v.layers[-1].data
+            lazy = self.mosaic.virtual_mosaic(sequence, tiles, objective=self.img_tools.objective)
+        else:
+            self.stitch = self.stream.result(sequence) if self.use_stream else None
+            if self.stitch is None:
+                logging.info('No streamed mosaic for this sequence, stitching the acquired tiles')
+                img_arr = self.main_window._core_link._mda_handler._tmp_arrays
+                self.stitch = self.mosaic.stitch_mosaic(sequence, img_arr, objective=self.img_tools.objective)
         mosaic_metadata = self.mosaic.get_mosaic_metadata(sequence)
         num_chan, chan_names = mosaic_metadata[2], mosaic_metadata[3]
 
         for chan, chan_name in zip(range(num_chan), chan_names):
-            mosaic = self.stitch[chan, :, :]
+            if LAZY_MOSAIC:
+                mosaic = lazy[chan]
+            else:
+                mosaic = self.mosaic.build_pyramid(self.stitch[chan, :, :])
             if chan_name == 'DAPI':
                 color = Colormap([[0, 0, 0], [0.16, 0.82, 0.79]], name='DAPI-cyan')
             elif chan_name == 'GFP':
@@ -324,7 +431,7 @@ class FishSorter:
                 color = Colormap([[0, 0, 0], [0.93, 0.13, 0.53]], name='CY5-plasma')
             else:
                 color = 'grey'
-            self.v.add_image(mosaic, colormap=color, blending='additive', name=chan_name)
+            self.v.add_image(mosaic, multiscale=True, colormap=color, blending='additive', name=chan_name)
 
         logging.info('Remove unncessary layers')
         remove_layers = []
@@ -354,7 +461,8 @@ class FishSorter:
             logging.info(f'Removed layer {layer}')        
 
     def _save_mosaic(self, layers):
-        """Saves the mosaic layers safely to prevent QT crashes
+        """Queues the mosaic layers to be saved as chunked OME-Zarr by the background writer,
+        so classification does not wait on the disk
 
         :param layers: list of layers to save
         :type layers: napari layers
@@ -362,9 +470,11 @@ class FishSorter:
 
         logging.info('Saving mosaic layers')
         for layer in layers:
-            save_path = Path(self.expt_path) / f"{layer.name}.tif"
-            imwrite(save_path, layer.data)
-            logging.info(f'Saved layer {layer}')
+            save_path = Path(self.expt_path) / f"{layer.name}.ome.zarr"
+            # Levels are passed as is, a lazy VirtualMosaic is read strip by strip while it is written
+            pyramid = list(layer.data) if getattr(layer, 'multiscale', False) else [layer.data]
+            self.writer.submit(save_path, pyramid, self.img_tools.pixel_size_um)
+            logging.info(f'Queued layer {layer} to save to {save_path}')
 
         logging.info('Ready to classify')
         self.run_class()
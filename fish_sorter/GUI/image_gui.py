@@ -11,6 +11,7 @@ from qtpy.QtWidgets import (
     QPushButton, 
     QSizePolicy,
     QHBoxLayout,
+    QLineEdit,
     QWidget
 )
 
@@ -33,6 +34,14 @@ class ImageWidget(QWidget):
         self.mosaic_btn = QPushButton("Stitch mosaic")
         self.class_btn = QPushButton("Classify")
         self.cross_btn = QPushButton('Crosshairs')
+        self.flat_btn = QPushButton('Flat-field')
+        self.flat_btn.setToolTip('Calibrate the flat-field of the current channel and objective on a uniform slide')
+        self.fid_well = QLineEdit()
+        self.fid_well.setPlaceholderText('Well')
+        self.fid_well.setMaximumWidth(60)
+        self.fid_btn = QPushButton('Add fiducial')
+        self.fid_btn.setToolTip('Record the current stage position as the center of the well, 3 or more fit the plate affine')
+        self.fid_clear_btn = QPushButton('Clear fiducials')
        
         self.crosshair_layer = 'crosshairs'
         self.cross_btn.setToolTip('Toggle crosshairs')
@@ -42,6 +51,10 @@ class ImageWidget(QWidget):
         layout.addWidget(self.mosaic_btn)
         layout.addWidget(self.class_btn)
         layout.addWidget(self.cross_btn)
+        layout.addWidget(self.flat_btn)
+        layout.addWidget(self.fid_well)
+        layout.addWidget(self.fid_btn)
+        layout.addWidget(self.fid_clear_btn)
         self.setLayout(layout)
         
     def _create_crosshairs(self):
@@ -84,6 +97,7 @@ class ImageWidget(QWidget):
         logging.info('Getting the magnification')
         obj_dev = self.mmc.guessObjectiveDevices()[0]
         obj_label = self.mmc.getStateLabel(obj_dev)
+        self.objective = obj_label
 
         match = re.search(r'([\d.]+)x', obj_label)
         if match:
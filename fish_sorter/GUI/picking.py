@@ -9,6 +9,7 @@ from pathlib import Path
 from time import sleep
 from typing import List, Optional, Tuple
 
+from fish_sorter.constants import PICK_BODY_CENTER
 from fish_sorter.hardware.picking_pipette import PickingPipette
 from fish_sorter.hardware.imaging_plate import ImagingPlate
 from fish_sorter.hardware.dispense_plate import DispensePlate
@@ -177,20 +178,25 @@ class Pick():
         """
 
         logging.info('Begin iterating through pick list')
-        self.matches.drop(columns=['lHead']).head(0).to_csv(self.picked_file, index=False)
+        picked = self.matches.drop(columns=['lHead', 'bodyX_um', 'bodyY_um'], errors='ignore')
+        picked.head(0).to_csv(self.picked_file, index=False)
         self.phc.move_pipette('clearance')
         self.phc.dest_home()
         yield 'Moved hardware for picking', False
         
         for match in self.matches.index:
-            if self.matches['lHead'][match]:
+            body = self._body_offset(match)
+            if body is not None:
+                offset = body
+                logging.info(f'Offset body center:{offset}')
+            elif self.matches['lHead'][match]:
                 offset = np.array([-self.pick_offset[0], self.pick_offset[1]])
                 logging.info(f'Offset left head:{offset}')
             else:
                 offset = self.pick_offset
                 logging.info(f'Offset right head:{offset}')
             
-            self.iplate.go_to_well(self.matches['slotName'][match], offset)
+            self.iplate.go_to_pos(self.pick_pos[match] + offset, self.matches['slotName'][match])
             yield 'Move to well', False
             self.phc.move_pipette('pick')
             yield from self._troubled_sleep(self.dtime)
@@ -198,7 +204,7 @@ class Pick():
             yield from self._troubled_sleep(self.dtime)
             self.phc.move_pipette('clearance')
             yield 'Move to clearance', False
-            self.phc.dplate.go_to_well(self.matches['dispenseWell'][match])
+            self.phc.dplate.go_to_pos(self.dispense_pos[match], self.matches['dispenseWell'][match])
             yield 'Move dispense plate', False
             self.phc.move_pipette('dispense')
             yield 'Move to dispense', False
@@ -213,7 +219,7 @@ class Pick():
             logging.info(msg)
             yield msg, True
 
-            pd.DataFrame([self.matches.drop(columns=['lHead']).iloc[match].values], columns=self.matches.drop(columns=['lHead']).columns)\
+            pd.DataFrame([picked.iloc[match].values], columns=picked.columns)\
                 .to_csv(self.picked_file, mode='a', header=False, index=False)
 
         yield 'Completed picking'
@@ -245,6 +251,26 @@ class Pick():
 
         logging.info('Finished Picking!')
 
+    def _body_offset(self, match):
+        """Offset from the well center to the body center of the fish, if enabled and measured
+
+        The width offset still applies across the well so the pipette clears the fish
+
+        :param match: index in the pick list
+        :type match: int
+
+        :return: x, y offset in um, None to use the fixed length offset
+        :rtype: np.ndarray
+        """
+
+        if not PICK_BODY_CENTER or 'bodyX_um' not in self.matches or 'bodyY_um' not in self.matches:
+            return None
+        body = np.array([self.matches['bodyX_um'][match], self.matches['bodyY_um'][match]], dtype=float)
+        if not np.all(np.isfinite(body)):
+            return None
+
+        return body + np.array([0, self.pick_offset[1]])
+
     @requires_setup
     def match_pick(self):
         """Matches the desired pick parameters to the classification
@@ -256,6 +282,20 @@ class Pick():
         merge = pd.merge(class_drop, pick_param_drop, on=list(matching), how='inner')
         merge_sorted = pd.merge(self.pick_param_file[['dispenseWell']], merge, on='dispenseWell', how='inner')
         self.matches = pd.DataFrame({'slotName': merge_sorted['slotName'], 'dispenseWell': merge_sorted['dispenseWell'], 'lHead': merge_sorted['lHead']})
+        for column in ['bodyX_um', 'bodyY_um']:
+            if column in merge_sorted:
+                self.matches[column] = merge_sorted[column]
+
+        # Stage positions of the whole pick list are looked up once, wells missing from either plate are dropped
+        pick_pos = self.iplate.get_positions(self.matches['slotName'])
+        dispense_pos = self.phc.dplate.get_positions(self.matches['dispenseWell'])
+        known = np.all(np.isfinite(pick_pos), axis=1) & np.all(np.isfinite(dispense_pos), axis=1)
+        if not np.all(known):
+            unknown = self.matches.loc[~known, ['slotName', 'dispenseWell']].values.tolist()
+            logging.warning(f'Dropped {len(unknown)} matches with wells not on the plates: {unknown}')
+        self.matches = self.matches[known].reset_index(drop=True)
+        self.pick_pos = pick_pos[known]
+        self.dispense_pos = dispense_pos[known]
         logging.info('Created pick list')
 
     @requires_setup
@@ -10,6 +10,31 @@ CAM_Y_PX = 2048
 # Flip image when stitching mosaic
 MIRROR_X = False
 
+# Number of channels stitched concurrently, each holds a uint32 copy of the mosaic
+STITCH_WORKERS = 2
+
+# Number of well chunks measured concurrently by the detection passes, each holds a float32 buffer of its chunk
+DETECT_WORKERS = 2
+
+# Refine tile positions by phase correlation of the overlaps when stitching mosaic
+REGISTER_TILES = False
+
+# Flat-field and dark-frame correct tiles when stitching mosaic
+FLATFIELD_CORRECT = False
+
+# Display the mosaic as a lazy view of the tiles instead of stitching it into memory
+LAZY_MOSAIC = False
+
+# Directory of saved classifications and well features the pre-classifier trains on, e.g. the experiments folder,
+# None to not pre-classify
+CLASSIFY_TRAINING_DIR = None
+
+# Wells pre-classified with a lower confidence are visited in low confidence navigation
+CLASSIFY_CONFIDENCE = 0.8
+
+# Pick at the body center found from the fish orientation instead of the fixed length offset
+PICK_BODY_CENTER = False
+
 # PIXEL_SIZE_UM = CAMERA_PIXEL_SIZE_UM / MAG
 # FOV_WIDTH = CAM_X_PX * PIXEL_SIZE_UM
 # PIXELS_TO_MM = IMG_PIXELS_TO_MM / MAG
@@ -60,6 +60,17 @@ class DispensePlate(Mapping):
 
         if well is not None:
             x, y = self._get_well_pos(well, offset)
-            self.zc.move_arm('x', x / MM_TO_UM, is_relative=False)
-            self.zc.move_arm('y', y / MM_TO_UM, is_relative=False)
-            logging.info(f'Moved dispense plate to well {well}')
+            self.go_to_pos(np.array([x, y]), well)
+
+    def go_to_pos(self, pos, label: Optional[str]=None):
+        """Move the dispense plate to a position computed ahead of time, e.g. a row of get_positions
+
+        :param pos: x, y stage position in um
+        :type pos: np.ndarray
+        :param label: well name for the log
+        :type label: str
+        """
+
+        self.zc.move_arm('x', pos[0] / MM_TO_UM, is_relative=False)
+        self.zc.move_arm('y', pos[1] / MM_TO_UM, is_relative=False)
+        logging.info(f'Moved dispense plate to well {label}')
@@ -30,7 +30,19 @@ class ImagingPlate(Mapping):
     def go_to_well(self, well: Optional[str], offset=np.array([0,0])):
         if well is not None:
             x, y = self._get_well_pos(well, offset)
-            # Move z pos too?
-            self.mmc.setXYPosition(x, y)
-            self.mmc.waitForDevice(self.mmc.getXYStageDevice())
-            logging.info(f'Moved stage to {well}, at [{x}, {y}]')
\ No newline at end of file
+            self.go_to_pos(np.array([x, y]), well)
+
+    def go_to_pos(self, pos, label: Optional[str]=None):
+        """Move the stage to a position computed ahead of time, e.g. a row of get_positions
+
+        :param pos: x, y stage position in um
+        :type pos: np.ndarray
+        :param label: well name for the log
+        :type label: str
+        """
+
+        x, y = float(pos[0]), float(pos[1])
+        # Move z pos too?
+        self.mmc.setXYPosition(x, y)
+        self.mmc.waitForDevice(self.mmc.getXYStageDevice())
+        logging.info(f'Moved stage to {label}, at [{x}, {y}]')
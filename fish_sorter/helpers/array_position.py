@@ -1,4 +1,5 @@
 import json
+import numpy as np
 import sys
 import os
 from datetime import datetime
@@ -17,6 +18,9 @@ from qtpy.QtWidgets import (
     QWidget
 )
 
+from fish_sorter.helpers.mapping import save_well_file
+
+
 class GenerateArray(QWidget):
     def __init__(self):
         super().__init__()
@@ -96,10 +100,18 @@ class GenerateArray(QWidget):
             well_names = self.generate_well_names(rows, columns)
             well_coordinates = self.generate_well_coordinates(rows, columns, row_spacing, column_spacing, length, width)
 
+            date_stamp = datetime.now().strftime("%Y%m%d")
+            array_file = f"{num_wells}{shape}{date_stamp}.json"
+            array_dir = Path(__file__).parent.parent.absolute() / "configs/arrays"
+            array_path = os.path.join(array_dir, array_file)
+
+            # Names and coordinates go in a binary companion file, loaded by memory map
+            well_file = f"{num_wells}{shape}{date_stamp}.npy"
+            save_well_file(os.path.join(array_dir, well_file), well_names, well_coordinates)
+
             well_def = {
                 'total_wells': num_wells,
-                'well_names': well_names,
-                'well_coordinates': well_coordinates
+                'well_file': well_file
             }
 
             data = {
@@ -107,11 +119,6 @@ class GenerateArray(QWidget):
                 'wells': well_def
             }
 
-            date_stamp = datetime.now().strftime("%Y%m%d")
-            array_file = f"{num_wells}{shape}{date_stamp}.json"
-            array_dir = Path(__file__).parent.parent.absolute() / "configs/arrays"
-            array_path = os.path.join(array_dir, array_file)
-
             with open(array_path, 'w') as json_file:
                 json.dump(data, json_file, indent=4)
 
@@ -120,6 +127,18 @@ class GenerateArray(QWidget):
             QMessageBox.critical(self, 'Error', f'An error occurred: {str(e)}')
 
     def generate_well_names(self, rows, columns):
+        """
+        Names the wells row by row, rows lettered A, B, ..., Z, AA, AB, ... and columns numbered 01, 02, ...
+
+        :param rows: number of rows
+        :type rows: int
+        :param columns: number of columns
+        :type columns: int
+
+        :return: well names
+        :rtype: np.ndarray
+        """
+
         def get_column_name(n):
             name = ''
             while n > 0:
@@ -127,19 +146,24 @@ class GenerateArray(QWidget):
                 name = chr(65 + remainder) + name
             return name
 
-        well_names = []
-        for r in range(rows):
-            row_label = get_column_name(r + 1)
-            for c in range(columns):
-                col_label = f"{c + 1:02}"
-                well_names.append(f"{row_label}{col_label}")
-        return well_names
+        row_labels = np.array([get_column_name(r + 1) for r in range(rows)])
+        col_labels = np.char.zfill(np.arange(1, columns + 1).astype(str), 2)
+
+        return np.char.add(np.repeat(row_labels, columns), np.tile(col_labels, rows))
 
     def generate_well_coordinates(self, rows, columns, row_spacing, column_spacing, length, width):
+        """
+        Expected well coordinates relative to the first well
+
+        :return: (x, y) coordinates [um], shaped (rows, columns, 2)
+        :rtype: np.ndarray
+        """
+
         x_spacing = column_spacing + length
         y_spacing = row_spacing + width
-        well_coordinates = [[(c * x_spacing, r * y_spacing) for c in range(columns)] for r in range(rows)]
-        return well_coordinates
+        y, x = np.meshgrid(np.arange(rows) * y_spacing, np.arange(columns) * x_spacing, indexing='ij')
+
+        return np.stack((x, y), axis=-1)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -0,0 +1,102 @@
+import collections
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class CalibrationStore:
+    """Caches plate calibrations in memory and on disk so experiments can be reopened without recalibrating
+
+    Entries are keyed by the array file, objective, grid plan and anything else the calibration
+    depends on, and hold the arrays from Mapping.calibration_state
+    """
+
+    def __init__(self, store_dir=None, maxsize: int=8):
+        """
+        :param store_dir: directory of the on disk store, usually inside the experiment directory.
+            None to only cache in memory
+        :type store_dir: Path
+        :param maxsize: number of calibrations kept in memory
+        :type maxsize: int
+        """
+
+        self.store_dir = Path(store_dir) if store_dir is not None else None
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+
+    @staticmethod
+    def key(array_file, objective, grid_plan, *args) -> str:
+        """Cache key of a calibration
+
+        :param array_file: path to the array config, its modification time is part of the key
+        :type array_file: str or Path
+        :param objective: objective label or magnification
+        :type objective: str
+        :param grid_plan: grid plan of the imaging sequence
+        :type grid_plan: useq.GridFromEdges
+        :param args: further JSON serializable values the calibration depends on
+
+        :return: hex digest of the inputs
+        :rtype: str
+        """
+
+        array_file = os.path.abspath(array_file)
+        grid = grid_plan.model_dump(mode='json') if hasattr(grid_plan, 'model_dump') else grid_plan
+        parts = [array_file, os.path.getmtime(array_file), objective, grid, *args]
+
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str):
+        """Get a calibration from memory or disk
+
+        :param key: cache key from CalibrationStore.key
+        :type key: str
+
+        :return: calibration state, None if not stored
+        :rtype: dict
+        """
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if self.store_dir is not None:
+            store_file = self.store_dir / f'{key}.npz'
+            if store_file.exists():
+                with np.load(store_file) as stored:
+                    state = {name: stored[name] for name in stored.files}
+                logging.info(f'Loaded calibration from {store_file}')
+                self._remember(key, state)
+                return state
+        return None
+
+    def put(self, key: str, state: dict):
+        """Store a calibration in memory and on disk
+
+        :param key: cache key from CalibrationStore.key
+        :type key: str
+        :param state: calibration arrays from Mapping.calibration_state
+        :type state: dict
+        """
+
+        self._remember(key, state)
+        if self.store_dir is not None:
+            try:
+                self.store_dir.mkdir(parents=True, exist_ok=True)
+                np.savez(self.store_dir / f'{key}.npz', **state)
+                logging.info(f'Saved calibration to {self.store_dir / key}.npz')
+            except OSError as e:
+                logging.warning(f'Could not write calibration store: {e}')
+
+    def _remember(self, key, state):
+        """Add to the in memory LRU, evicting the least recently used calibration"""
+
+        self._cache[key] = state
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
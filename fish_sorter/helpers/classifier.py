@@ -0,0 +1,335 @@
+import functools
+import logging
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+
+# Optional, the NumPy logistic regression is used without it
+try:
+    from sklearn.linear_model import LogisticRegression
+except ModuleNotFoundError:
+    LogisticRegression = None
+
+log = logging.getLogger(__name__)
+
+
+def find_training_files(root, max_depth: int=2) -> list:
+    """Finds saved classifications that have a matching well feature table
+
+    Classify.save_data writes <timestamp>_<prefix>_classifications.csv next to
+    <timestamp>_<prefix>_features.npy
+
+    :param root: directory to search, e.g. the parent directory of the experiments
+    :type root: str or Path
+    :param max_depth: number of directory levels below root to search
+    :type max_depth: int
+
+    :return: (classification csv, feature table) path pairs
+    :rtype: list of tuple
+    """
+
+    root = Path(root)
+    pairs = []
+    for depth in range(max_depth + 1):
+        for csv_file in root.glob('/'.join(['*'] * depth + ['*_classifications.csv'])):
+            feature_file = csv_file.with_name(csv_file.name.replace('_classifications.csv', '_features.npy'))
+            if feature_file.exists():
+                pairs.append((csv_file, feature_file))
+
+    return sorted(set(pairs))
+
+
+def train_classifier(root, pick_type: str, well_labels: list, feature_labels: list, well_names: list):
+    """Classifier trained on the saved classifications under a directory
+
+    Fitted classifiers are cached per pick type and are only refit when classifications are
+    saved or changed under the directory
+
+    :param root: directory of the saved classifications, see find_training_files
+    :type root: str or Path
+    :param pick_type: pick type the classifications are of
+    :type pick_type: str
+    :param well_labels: mutually exclusive well classes from the pick type config
+    :type well_labels: list of str
+    :param feature_labels: fish features from the pick type config
+    :type feature_labels: list of str
+    :param well_names: name of each well in the plate order of the feature tables
+    :type well_names: list of str
+
+    :return: trained classifier, None without enough saved classifications
+    :rtype: WellClassifier
+    """
+
+    pairs = find_training_files(root)
+    if not pairs:
+        log.info(f'No saved classifications with features under {root} to train the classifier')
+        return None
+    files = tuple((str(csv_file), str(feature_file), csv_file.stat().st_mtime, feature_file.stat().st_mtime) for csv_file, feature_file in pairs)
+
+    return _fit_classifier(pick_type, tuple(well_labels), tuple(feature_labels), tuple(well_names), files)
+
+
+@functools.lru_cache(maxsize=4)
+def _fit_classifier(pick_type, well_labels, feature_labels, well_names, files):
+    # Modification times are part of the key so changed training files refit the classifier
+    pairs = [(Path(csv_file), Path(feature_file)) for csv_file, feature_file, *_ in files]
+    X, Y, names = load_training_data(pairs, list(well_labels + feature_labels), list(well_names))
+    classifier = WellClassifier(well_labels, feature_labels)
+    if len(X) == 0 or not classifier.fit(X, Y, names):
+        return None
+    log.info(f'Trained the {pick_type} classifier on {len(files)} saved classifications')
+
+    return classifier
+
+
+def load_training_data(pairs: list, labels: list, well_names: list, well_column: str='slotName'):
+    """Joins saved classifications with their well feature tables
+
+    The feature table rows are in plate order, each classified well is matched to its row by name.
+    Tables of a different plate are skipped, only features present in every table are used, and
+    labels missing from a classification are False
+
+    :param pairs: (classification csv, feature table) path pairs from find_training_files
+    :type pairs: list of tuple
+    :param labels: classification columns to load
+    :type labels: list of str
+    :param well_names: name of each well in the plate order of the feature tables
+    :type well_names: list of str
+    :param well_column: classification column with the well names
+    :type well_column: str
+
+    :return: features (n_wells, n_features), labels (n_wells, n_labels) and the feature names
+    :rtype: np.ndarray, np.ndarray, list of str
+    """
+
+    rows = {name: i for i, name in enumerate(well_names)}
+    tables = []
+    classes = []
+    for csv_file, feature_file in pairs:
+        class_df = pd.read_csv(csv_file)
+        table = np.load(feature_file)
+        if len(table) != len(well_names) or well_column not in class_df:
+            log.warning(f'Skipping {csv_file}, not classified on a plate of {len(well_names)} wells')
+            continue
+        known = class_df[well_column].isin(list(rows))
+        if not known.all():
+            log.warning(f'Skipping {int((~known).sum())} wells of {csv_file} that are not on the plate')
+            class_df = class_df[known]
+        tables.append(table[class_df[well_column].map(rows).to_numpy()])
+        classes.append(
+            np.stack([
+                class_df[label].to_numpy().astype(bool) if label in class_df else np.zeros(len(class_df), bool)
+                for label in labels
+            ], axis=1)
+        )
+
+    if not tables:
+        return np.zeros((0, 0)), np.zeros((0, len(labels)), bool), []
+
+    names = [name for name in tables[0].dtype.names if all(name in table.dtype.names for table in tables)]
+    X = np.concatenate([feature_matrix(table, names) for table in tables])
+    Y = np.concatenate(classes)
+
+    return X, Y, names
+
+
+def feature_matrix(table, names: list):
+    """Feature table columns as a float matrix
+
+    :param table: well feature table from well_features
+    :type table: np.ndarray
+    :param names: feature names, one column each
+    :type names: list of str
+
+    :return: (n_wells, n_features) features
+    :rtype: np.ndarray
+    """
+
+    return np.stack([table[name].astype(np.float64) for name in names], axis=1)
+
+
+class SoftmaxRegression:
+    """Multinomial logistic regression fitted by gradient descent, NumPy only
+    """
+
+    def __init__(self, l2: float=1e-2, lr: float=0.5, n_iter: int=500):
+        """
+        :param l2: L2 penalty of the weights
+        :type l2: float
+        :param lr: gradient descent step size
+        :type lr: float
+        :param n_iter: number of gradient descent steps
+        :type n_iter: int
+        """
+
+        self.l2 = l2
+        self.lr = lr
+        self.n_iter = n_iter
+
+    def fit(self, X, y):
+        """
+        :param X: standardized features (n_samples, n_features)
+        :type X: np.ndarray
+        :param y: class of each sample
+        :type y: np.ndarray
+
+        :return: self
+        :rtype: SoftmaxRegression
+        """
+
+        self.classes_, y_idx = np.unique(y, return_inverse=True)
+        onehot = np.eye(len(self.classes_))[y_idx]
+        self.W = np.zeros((X.shape[1], len(self.classes_)))
+        self.b = np.zeros(len(self.classes_))
+
+        for _ in range(self.n_iter):
+            grad = (self.predict_proba(X) - onehot) / len(X)
+            self.W -= self.lr * (X.T @ grad + self.l2 * self.W)
+            self.b -= self.lr * grad.sum(axis=0)
+
+        return self
+
+    def predict_proba(self, X):
+        """
+        :param X: standardized features (n_samples, n_features)
+        :type X: np.ndarray
+
+        :return: probability of each class in classes_, (n_samples, n_classes)
+        :rtype: np.ndarray
+        """
+
+        logits = X @ self.W + self.b
+        logits -= logits.max(axis=1, keepdims=True)
+        prob = np.exp(logits)
+
+        return prob / prob.sum(axis=1, keepdims=True)
+
+
+class WellClassifier:
+    """Predicts the well and feature classifications of a plate from its well feature table
+
+    The well classes (empty, singlet, multiple, ...) are mutually exclusive and predicted by one
+    multinomial model, each fish feature is a separate binary model trained on singlets only.
+    Uses scikit-learn when it is installed and a NumPy logistic regression otherwise.
+    """
+
+    def __init__(self, well_labels: list, feature_labels: list, min_samples: int=50, singlet: str='singlet'):
+        """
+        :param well_labels: mutually exclusive well classes from the pick type config
+        :type well_labels: list of str
+        :param feature_labels: fish features from the pick type config
+        :type feature_labels: list of str
+        :param min_samples: fewest classified wells to train on
+        :type min_samples: int
+        :param singlet: well class of wells with a single fish, which have fish features
+        :type singlet: str
+        """
+
+        self.well_labels = list(well_labels)
+        self.feature_labels = list(feature_labels)
+        self.min_samples = min_samples
+        self.singlet = singlet
+        self.models = {}
+        self.feature_names = []
+        self.trained = False
+
+    def _model(self):
+        if LogisticRegression is not None:
+            return LogisticRegression(max_iter=1000)
+        return SoftmaxRegression()
+
+    def _standardize(self, X):
+        return (X - self.mean) / self.scale
+
+    def fit(self, X, Y, feature_names: list):
+        """Train on classified wells
+
+        :param X: features (n_wells, n_features)
+        :type X: np.ndarray
+        :param Y: classifications (n_wells, n_labels), columns are the well labels then the feature labels
+        :type Y: np.ndarray
+        :param feature_names: name of each feature column
+        :type feature_names: list of str
+
+        :return: whether there was enough data to train
+        :rtype: bool
+        """
+
+        n_well = len(self.well_labels)
+        well_Y = Y[:, :n_well]
+        labeled = well_Y.any(axis=1)
+        if labeled.sum() < self.min_samples:
+            log.info(f'Not enough classified wells to train the classifier, {labeled.sum()} of {self.min_samples}')
+            return False
+
+        self.feature_names = list(feature_names)
+        self.mean = X[labeled].mean(axis=0)
+        self.scale = np.where(X[labeled].std(axis=0) > 0, X[labeled].std(axis=0), 1.0)
+        Xs = self._standardize(X)
+
+        self.models = {}
+        well_y = np.argmax(well_Y[labeled], axis=1)
+        self.models['well_class'] = self._fit_or_constant(Xs[labeled], well_y)
+
+        singlets = labeled & well_Y[:, self.well_labels.index(self.singlet)] if self.singlet in self.well_labels else labeled
+        for i, label in enumerate(self.feature_labels):
+            if singlets.sum() == 0:
+                break
+            self.models[label] = self._fit_or_constant(Xs[singlets], Y[singlets, n_well + i].astype(int))
+
+        self.trained = True
+        log.info(f'Trained classifier on {labeled.sum()} wells and {singlets.sum()} singlets')
+
+        return True
+
+    def _fit_or_constant(self, X, y):
+        """Fit a model, or remember the class if only one is present"""
+
+        if len(np.unique(y)) < 2:
+            return int(y[0])
+        return self._model().fit(X, y)
+
+    def _proba(self, model, X, n_classes):
+        """Probability of each class index in [0, n_classes)"""
+
+        prob = np.zeros((len(X), n_classes))
+        if isinstance(model, int):
+            prob[:, model] = 1.0
+        else:
+            prob[:, np.asarray(model.classes_, dtype=int)] = model.predict_proba(X)
+        return prob
+
+    def predict(self, table):
+        """Predict the classifications of every well
+
+        :param table: well feature table from well_features
+        :type table: np.ndarray
+
+        :return: label name to predicted bool per well, and the confidence of each well in [0, 1],
+            the lowest probability of any of its predicted labels, None if the table lacks trained features
+        :rtype: tuple of dict, np.ndarray
+        """
+
+        # The features depend on the image layers, e.g. the sum_ features only exist with several channels
+        missing = [name for name in self.feature_names if name not in table.dtype.names]
+        if missing:
+            log.warning(f'Not predicting, the well features lack {", ".join(missing)} the classifier was trained on')
+            return None
+
+        Xs = self._standardize(feature_matrix(table, self.feature_names))
+        well_prob = self._proba(self.models['well_class'], Xs, len(self.well_labels))
+        well_class = np.argmax(well_prob, axis=1)
+        confidence = well_prob.max(axis=1)
+
+        predictions = {label: well_class == i for i, label in enumerate(self.well_labels)}
+        singlets = predictions.get(self.singlet, np.ones(len(Xs), bool))
+        for label in self.feature_labels:
+            if label not in self.models:
+                continue
+            prob = self._proba(self.models[label], Xs, 2)[:, 1]
+            predictions[label] = singlets & (prob > 0.5)
+            label_conf = np.maximum(prob, 1 - prob)
+            confidence = np.where(singlets, np.minimum(confidence, label_conf), confidence)
+
+        return predictions, confidence
@@ -0,0 +1,234 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+log = logging.getLogger(__name__)
+
+
+def crop_origins(centers, shape):
+    """Top left pixel of the crop window around each well center
+
+    :param centers: (y, x) well centers (row, col) in image pixels
+    :type centers: np.ndarray
+    :param shape: (h, w) crop shape
+    :type shape: tuple
+
+    :return: (y, x) top left corner of each crop
+    :rtype: np.ndarray
+    """
+
+    centers = np.asarray(centers).reshape(-1, 2).astype(int)
+
+    return centers - np.array(shape) // 2
+
+
+def crop_wells(image, centers, shape, out=None, wells=None, chunk: int=64):
+    """Extracts a crop around every well into a single (n_wells, h, w) stack
+
+    Wells fully inside the image are gathered by fancy indexing a strided window view of the image,
+    so no per well buffers are allocated. Crops overlapping the image border are zero padded.
+
+    :param image: 2D image, an array-like that only supports slicing is cropped well by well
+    :type image: np.ndarray
+    :param centers: (y, x) well centers (row, col) in image pixels
+    :type centers: np.ndarray
+    :param shape: (h, w) crop shape
+    :type shape: tuple
+    :param out: preallocated (n_wells, h, w) array to fill, allocated if None
+    :type out: np.ndarray
+    :param wells: indices of the wells to crop, None for all wells
+    :type wells: np.ndarray
+    :param chunk: wells gathered per fancy indexing step, bounds the temporary memory
+    :type chunk: int
+
+    :return: crop stack
+    :rtype: np.ndarray
+    """
+
+    h, w = shape
+    origins = crop_origins(centers, shape)
+    if out is None:
+        out = np.zeros((len(origins), h, w), dtype=image.dtype)
+    wells = np.arange(len(origins)) if wells is None else np.asarray(wells, dtype=int)
+
+    img_h, img_w = image.shape[0:2]
+    well_origins = origins[wells]
+    inside = (
+        (well_origins[:, 0] >= 0) & (well_origins[:, 1] >= 0)
+        & (well_origins[:, 0] + h <= img_h) & (well_origins[:, 1] + w <= img_w)
+    )
+
+    if isinstance(image, np.ndarray) and img_h >= h and img_w >= w:
+        windows = sliding_window_view(image, (h, w))
+        idxs = wells[inside]
+        for start in range(0, len(idxs), chunk):
+            batch = idxs[start : start + chunk]
+            out[batch] = windows[origins[batch, 0], origins[batch, 1]]
+        border = wells[~inside]
+    else:
+        border = wells
+
+    for i in border:
+        y0, x0 = origins[i]
+        y1, x1 = max(y0, 0), max(x0, 0)
+        y2, x2 = min(y0 + h, img_h), min(x0 + w, img_w)
+        out[i] = 0
+        if y2 > y1 and x2 > x1:
+            out[i, y1 - y0 : y2 - y0, x1 - x0 : x2 - x0] = image[y1:y2, x1:x2]
+        else:
+            logging.info(f'Well at {origins[i] + np.array(shape) // 2} is outside of the image')
+
+    return out
+
+
+class WellCropCache:
+    """Crops wells on demand and keeps only the most recently used ones
+
+    Memory stays bounded by the cache size regardless of the number of wells. Wells that are
+    likely to be shown next can be cropped ahead of time in a background thread with prefetch.
+    Indexing by well returns a dict of channel name to the masked crop.
+    """
+
+    def __init__(self, images: dict, centers, mask, maxsize: int=32):
+        """
+        :param images: channel name to 2D image
+        :type images: dict
+        :param centers: (y, x) well centers (row, col) in image pixels
+        :type centers: np.ndarray
+        :param mask: (h, w) well mask, also sets the crop shape
+        :type mask: np.ndarray
+        :param maxsize: number of wells kept in memory
+        :type maxsize: int
+        """
+
+        self.images = images
+        self.centers = np.asarray(centers).reshape(-1, 2)
+        self.mask = mask
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='well_prefetch')
+
+    @property
+    def names(self):
+        return list(self.images)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __getitem__(self, well: int) -> dict:
+        return self.get(well)
+
+    def __iter__(self):
+        for well in range(len(self)):
+            yield self.get(well, cache=False)
+
+    def crop(self, well: int, masked: bool=True) -> dict:
+        """Crop a single well from every channel without caching it
+
+        :param well: well index
+        :type well: int
+        :param masked: apply the well mask
+        :type masked: bool
+
+        :return: channel name to crop
+        :rtype: dict
+        """
+
+        if well < 0 or well >= len(self):
+            raise IndexError(f'Well {well} out of range for {len(self)} wells')
+        region = {}
+        for name, image in self.images.items():
+            crop = crop_wells(image, self.centers[[well]], self.mask.shape)[0]
+            region[name] = crop * self.mask if masked else crop
+
+        return region
+
+    def get(self, well: int, cache: bool=True) -> dict:
+        """Masked crops of a well, from the cache or cropped now
+
+        :param well: well index
+        :type well: int
+        :param cache: keep the crops in the cache, False for one off passes over many wells
+        :type cache: bool
+
+        :return: channel name to masked crop
+        :rtype: dict
+        """
+
+        well = int(well)
+        with self._lock:
+            if well in self._cache:
+                self._cache.move_to_end(well)
+                return self._cache[well]
+            pending = self._pending.get(well)
+
+        if pending is not None:
+            try:
+                return pending.result()
+            except concurrent.futures.CancelledError:
+                pass
+
+        region = self.crop(well)
+        if cache:
+            self._remember(well, region)
+
+        return region
+
+    def prefetch(self, wells):
+        """Crop wells in the background so they are cached when shown
+
+        :param wells: well indices, in the order they are likely to be needed
+        :type wells: iterable of int
+        """
+
+        for well in wells:
+            well = int(well)
+            with self._lock:
+                if well in self._cache or well in self._pending:
+                    continue
+                try:
+                    self._pending[well] = self.executor.submit(self._prefetch_one, well)
+                except RuntimeError:
+                    # Executor already shut down
+                    self._pending.pop(well, None)
+                    return
+
+    def _prefetch_one(self, well):
+        """Background crop of a single well"""
+
+        try:
+            region = self.crop(well)
+            self._remember(well, region)
+            return region
+        finally:
+            with self._lock:
+                self._pending.pop(well, None)
+
+    def _remember(self, well, region):
+        """Add to the LRU, evicting the least recently used well"""
+
+        with self._lock:
+            self._cache[well] = region
+            self._cache.move_to_end(well)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
+
+    def shutdown(self):
+        """Drop queued prefetches and stop the prefetch thread"""
+
+        try:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            self.executor.shutdown(wait=False)
+        self.clear()
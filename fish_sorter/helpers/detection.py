@@ -0,0 +1,324 @@
+import concurrent.futures
+import logging
+import numpy as np
+import threading
+
+from scipy import ndimage
+
+from fish_sorter.constants import DETECT_WORKERS
+from fish_sorter.helpers.crops import crop_wells
+
+log = logging.getLogger(__name__)
+
+
+def subsample(image, max_samples: int=2**20):
+    """Strided view of an image with at most about max_samples pixels
+
+    :param image: 2D image, any array-like that supports step slicing
+    :type image: np.ndarray
+    :param max_samples: approximate number of pixels to keep
+    :type max_samples: int
+
+    :return: subsampled image
+    :rtype: np.ndarray
+    """
+
+    step = max(int(np.ceil(np.sqrt(image.shape[0] * image.shape[1] / max_samples))), 1)
+
+    return np.asarray(image[::step, ::step])
+
+
+def sum_stats(images: list, max_samples: int=2**20):
+    """Mean and standard deviation of the sum of images, estimated from a strided subsample
+
+    :param images: 2D images of the same shape
+    :type images: list of np.ndarray
+    :param max_samples: approximate number of pixels sampled per image
+    :type max_samples: int
+
+    :return: mean, std
+    :rtype: float, float
+    """
+
+    total = np.zeros(subsample(images[0], max_samples).shape, dtype=np.float64)
+    for image in images:
+        total += subsample(image, max_samples)
+
+    return float(total.mean()), float(total.std())
+
+
+# Per channel features of well_features, all float32
+WELL_FEATURES = (
+    'area',        # fraction of the crop above the threshold
+    'mean',        # mean intensity inside the well mask
+    'std',         # intensity standard deviation inside the well mask
+    'cy',          # centroid of the above threshold intensity, relative to the crop center [px]
+    'cx',
+    'angle',       # principal axis angle [rad], counterclockwise from the x axis
+    'elongation',  # major over minor axis length
+    'skew',        # intensity skewness along the principal axis
+    'asymmetry',   # (left - right) / (left + right) above threshold intensity
+)
+
+
+def _moment_basis(shape):
+    """Per column and per row powers used by _crop_features
+
+    Coordinates are relative to the crop center and scaled by half the larger side so the third
+    powers stay near 1 in float32
+
+    :return: (w, 5) column basis 1, x, x^2, x^3, left half; (h, 4) row basis 1, y, y^2, y^3; and the scale [px]
+    :rtype: np.ndarray, np.ndarray, float
+    """
+
+    h, w = shape
+    scale = max(h, w) / 2
+    x = (np.arange(w) - w // 2) / scale
+    y = (np.arange(h) - h // 2) / scale
+    cols = np.stack([np.ones(w), x, x**2, x**3, np.arange(w) < w // 2], axis=1).astype(np.float32)
+    rows = np.stack([np.ones(h), y, y**2, y**3], axis=1)
+
+    return cols, rows, scale
+
+
+def _crop_features(crops, thresh, mask, buf, basis):
+    """Features of a (k, h, w) stack of crops of one channel, see WELL_FEATURES
+
+    All per pixel work happens in place in buf, a float32 buffer of at least k crops reused between
+    chunks. The weighted moments are one matmul of the buffer with per column powers of x, reduced
+    over the rows with powers of y, so no other crop sized temporaries are allocated.
+    """
+
+    k = crops.shape[0]
+    buf = buf[:k]
+    cols, rows, scale = basis
+    n_mask = mask.sum()
+    feats = {}
+
+    np.copyto(buf, crops, casting='unsafe')
+    buf *= mask
+    mean = buf.sum(axis=(1, 2), dtype=np.float64) / n_mask
+    buf -= mean[:, None, None].astype(np.float32)
+    buf *= mask
+    np.square(buf, out=buf)
+    feats['mean'] = mean
+    feats['std'] = np.sqrt(buf.sum(axis=(1, 2), dtype=np.float64) / n_mask)
+
+    # Weights are the intensity above the threshold inside the well
+    np.copyto(buf, crops, casting='unsafe')
+    buf -= np.float32(thresh)
+    np.maximum(buf, 0, out=buf)
+    buf *= mask
+    feats['area'] = np.count_nonzero(buf.reshape(k, -1), axis=1) / mask.size
+
+    # m[:, p, q] is the sum of weight * x^p * y^q, m[:, 4, 0] the weight in the left half
+    by_row = (buf.reshape(-1, buf.shape[2]) @ cols).reshape(k, buf.shape[1], -1)
+    m = np.einsum('khp,hq->kpq', by_row.astype(np.float64), rows)
+    m00 = m[:, 0, 0]
+    safe = np.where(m00 > 0, m00, 1)
+    e = m / safe[:, None, None]
+    cx = e[:, 1, 0]
+    cy = e[:, 0, 1]
+    mu20 = e[:, 2, 0] - cx**2
+    mu02 = e[:, 0, 2] - cy**2
+    mu11 = e[:, 1, 1] - cx * cy
+    mu30 = e[:, 3, 0] - 3 * cx * e[:, 2, 0] + 2 * cx**3
+    mu03 = e[:, 0, 3] - 3 * cy * e[:, 0, 2] + 2 * cy**3
+    mu21 = e[:, 2, 1] - 2 * cx * e[:, 1, 1] - cy * e[:, 2, 0] + 2 * cx**2 * cy
+    mu12 = e[:, 1, 2] - 2 * cy * e[:, 1, 1] - cx * e[:, 0, 2] + 2 * cx * cy**2
+
+    # Principal axis of the second moments, y points down in the image so negate for counterclockwise
+    angle = 0.5 * np.arctan2(2 * mu11, mu20 - mu02)
+    spread = np.sqrt(((mu20 - mu02) / 2)**2 + mu11**2)
+    major = (mu20 + mu02) / 2 + spread
+    minor = np.maximum((mu20 + mu02) / 2 - spread, 1e-6 / scale**2)
+    c, s = np.cos(angle), np.sin(angle)
+    mu3 = c**3 * mu30 + 3 * c**2 * s * mu21 + 3 * c * s**2 * mu12 + s**3 * mu03
+
+    left = m[:, 4, 0]
+    right = m00 - left
+
+    feats['cy'] = cy * scale
+    feats['cx'] = cx * scale
+    feats['angle'] = -angle
+    feats['elongation'] = np.sqrt(major / minor)
+    feats['skew'] = mu3 / np.maximum(major, 1e-6 / scale**2)**1.5
+    feats['asymmetry'] = (left - right) / safe
+    empty = m00 == 0
+    for name in ('cy', 'cx', 'angle', 'elongation', 'skew', 'asymmetry'):
+        feats[name] = np.where(empty, 0, feats[name])
+
+    return feats
+
+
+def well_features(groups: dict, centers, mask, sigma: float, chunk: int=8, max_workers: int=DETECT_WORKERS,
+                  max_samples: int=2**20):
+    """Batched feature extraction of every well crop for each channel
+
+    Each group of images is summed, e.g. a single layer or the sum of the fluorescence layers,
+    and thresholded at sigma standard deviations over the mean of the group sum, estimated from
+    a subsample. Every image is cropped once per chunk of wells, whichever groups it is in.
+
+    :param groups: group name to the 2D images summed for that group
+    :type groups: dict
+    :param centers: (y, x) well centers (row, col) in image pixels
+    :type centers: np.ndarray
+    :param mask: (h, w) well mask, also sets the crop shape
+    :type mask: np.ndarray
+    :param sigma: number of standard deviations above the mean for the threshold
+    :type sigma: float
+    :param chunk: wells cropped per step, each worker holds about 3 float32 crops per well of the chunk
+    :type chunk: int
+    :param max_workers: threads processing chunks in parallel
+    :type max_workers: int
+    :param max_samples: approximate number of pixels sampled per image for the statistics
+    :type max_samples: int
+
+    :return: one row per well with a float32 field '<group>_<feature>' for each group and WELL_FEATURES entry
+    :rtype: np.ndarray
+    """
+
+    centers = np.asarray(centers).reshape(-1, 2)
+    threshs = {}
+    for name, images in groups.items():
+        mean, std = sum_stats(images, max_samples)
+        threshs[name] = mean + (sigma * std)
+
+    table = np.zeros(
+        len(centers),
+        dtype=[(f'{name}_{feat}', 'f4') for name in groups for feat in WELL_FEATURES],
+    )
+    basis = _moment_basis(mask.shape)
+    buffers = threading.local()
+
+    def _chunk(start):
+        chunk_centers = centers[start : start + chunk]
+        if getattr(buffers, 'buf', None) is None:
+            buffers.buf = np.empty((chunk, *mask.shape), dtype=np.float32)
+        crops = {}
+        for name, images in groups.items():
+            for image in images:
+                if id(image) not in crops:
+                    crops[id(image)] = crop_wells(image, chunk_centers, mask.shape)
+            if len(images) == 1:
+                total = crops[id(images[0])]
+            else:
+                acc_dtype = np.result_type(np.uint32, *[image.dtype for image in images])
+                total = np.zeros((len(chunk_centers), *mask.shape), dtype=acc_dtype)
+                for image in images:
+                    total += crops[id(image)]
+            feats = _crop_features(total, threshs[name], mask, buffers.buf, basis)
+            for feat, values in feats.items():
+                table[f'{name}_{feat}'][start : start + chunk] = values
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(_chunk, range(0, len(centers), chunk)))
+
+    return table
+
+
+def count_objects(images: list, centers, mask, sigma: float, min_area: float=0.001, chunk: int=8,
+                  max_workers: int=DETECT_WORKERS, max_samples: int=2**20):
+    """Counts the objects, e.g. fish, in every well by connected component labeling of the thresholded crops
+
+    The crops of a chunk of wells are labeled in a single call with a structure that only connects
+    pixels within a well. Chunks run in parallel and each returns its own counts, which are merged
+    once every chunk is done.
+
+    :param images: 2D images of the same shape, summed before thresholding
+    :type images: list of np.ndarray
+    :param centers: (y, x) well centers (row, col) in image pixels
+    :type centers: np.ndarray
+    :param mask: (h, w) well mask, also sets the crop shape
+    :type mask: np.ndarray
+    :param sigma: number of standard deviations above the mean for the threshold
+    :type sigma: float
+    :param min_area: smallest object as a fraction of the crop area, smaller objects are noise
+    :type min_area: float
+    :param chunk: wells labeled per step
+    :type chunk: int
+    :param max_workers: threads labeling chunks in parallel
+    :type max_workers: int
+    :param max_samples: approximate number of pixels sampled per image for the statistics
+    :type max_samples: int
+
+    :return: object count per well, and per well a list of its objects as
+        (area [px], (y1, x1, y2, x2) bounding box in crop pixels)
+    :rtype: np.ndarray, list of list
+    """
+
+    mean, std = sum_stats(images, max_samples)
+    thresh = mean + (sigma * std)
+    centers = np.asarray(centers).reshape(-1, 2)
+    min_px = min_area * mask.size
+    acc_dtype = np.result_type(np.uint32, *[image.dtype for image in images])
+
+    # Connect 8 neighbours within a crop but never across crops
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+
+    def _chunk(start):
+        chunk_centers = centers[start : start + chunk]
+        if len(images) == 1:
+            total = crop_wells(images[0], chunk_centers, mask.shape)
+        else:
+            total = np.zeros((len(chunk_centers), *mask.shape), dtype=acc_dtype)
+            for image in images:
+                total += crop_wells(image, chunk_centers, mask.shape)
+        labels, num = ndimage.label((total > thresh) & mask, structure=structure)
+        areas = np.bincount(labels.ravel(), minlength=num + 1)
+        chunk_counts = np.zeros(len(chunk_centers), dtype=np.int32)
+        chunk_objects = [[] for _ in range(len(chunk_centers))]
+        for label, box in enumerate(ndimage.find_objects(labels), start=1):
+            if box is None or areas[label] < min_px:
+                continue
+            well = box[0].start
+            chunk_counts[well] += 1
+            chunk_objects[well].append((int(areas[label]), (box[1].start, box[2].start, box[1].stop, box[2].stop)))
+
+        return start, chunk_counts, chunk_objects
+
+    counts = np.zeros(len(centers), dtype=np.int32)
+    objects = [[] for _ in range(len(centers))]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for start, chunk_counts, chunk_objects in pool.map(_chunk, range(0, len(centers), chunk)):
+            counts[start : start + len(chunk_counts)] = chunk_counts
+            objects[start : start + len(chunk_objects)] = chunk_objects
+
+    return counts, objects
+
+
+def fish_orientation(table, group: str, min_skew: float=0.05):
+    """Orientation of the fish from the image moments of the well feature table
+
+    The angle is the principal axis of the above threshold intensity and the body center its
+    centroid. The head is the brighter, heavier end, so the skewness along the axis points away
+    from it. Where the skewness is too small to tell, the brighter half of the well is the head side.
+
+    :param table: well feature table from well_features
+    :type table: np.ndarray
+    :param group: feature group to orient the fish with, the fish must be bright in it
+    :type group: str
+    :param min_skew: smallest skewness that tells the head side
+    :type min_skew: float
+
+    :return: head on the left, body angle [rad] counterclockwise from the x axis, skewness along the
+        axis, and (cy, cx) body center relative to the crop center [px], each per well
+    :rtype: dict
+    """
+
+    angle = table[f'{group}_angle'].astype(np.float64)
+    skew = table[f'{group}_skew'].astype(np.float64)
+
+    # The skewness is along (cos, -sin) of the angle in image coordinates, y down, the head is opposite
+    head_x = -np.sign(skew) * np.cos(angle)
+    brighter_left = table[f'{group}_asymmetry'] >= 0
+    lhead = np.where((np.abs(skew) > min_skew) & (np.abs(head_x) > 1e-3), head_x < 0, brighter_left)
+
+    return {
+        'lhead': lhead,
+        'angle': angle,
+        'skew': skew,
+        'cy': table[f'{group}_cy'].astype(np.float64),
+        'cx': table[f'{group}_cx'].astype(np.float64),
+    }
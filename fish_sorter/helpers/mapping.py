@@ -1,9 +1,13 @@
 # TODO clean up the imports
+import functools
+import logging
 import numpy as np
 import os
 import json
 
 from abc import ABC, abstractmethod
+from pathlib import Path
+from scipy.spatial import cKDTree
 
 # TODO dynamically load pixel count
 from fish_sorter.constants import (
@@ -15,6 +19,60 @@ from fish_sorter.constants import (
 #      unless manually overriden by set_center_to_corner_offset_um
 # TODO add type hints
 
+
+def load_well_file(well_path):
+    """
+    Memory maps the binary well table of an array
+
+    :param well_path: path to the .npy well table
+    :type well_path: str or Path
+
+    :return: read-only structured array with a 'name' and an (x, y) 'coord' [um] field per well
+    :rtype: np.memmap
+    """
+
+    return np.load(well_path, mmap_mode='r')
+
+
+def save_well_file(well_path, well_names, well_coordinates):
+    """
+    Saves well names and coordinates as a compact binary well table
+
+    :param well_path: path of the .npy well table to write
+    :type well_path: str or Path
+    :param well_names: names of the wells
+    :type well_names: np.ndarray
+    :param well_coordinates: (x, y) coordinates of the wells [um], one row per well
+    :type well_coordinates: np.ndarray
+    """
+
+    table = np.zeros(
+        len(well_names),
+        dtype=[('name', well_names.dtype), ('coord', 'f8', 2)],
+    )
+    table['name'] = well_names
+    table['coord'] = np.asarray(well_coordinates).reshape(-1, 2)
+    np.save(well_path, table)
+
+
+@functools.lru_cache(maxsize=8)
+def _read_array_file(array_file, mtime):
+    # Parsed array definitions are shared by every plate using the same, unchanged file
+    with open(array_file) as f:
+        plate_data = json.load(f)
+
+    wells = plate_data['wells']
+    if 'well_file' in wells:
+        table = load_well_file(Path(array_file).parent / wells['well_file'])
+        names = table['name'].tolist()
+        coords = table['coord']
+    else:
+        names = wells['well_names']
+        coords = np.array(wells['well_coordinates'], dtype=float).reshape(-1, 2)
+
+    return plate_data, names, coords
+
+
 class Mapping:
     def __init__(self, array_file, pixel_size_um):
         # NOTE Does mda return z values?
@@ -36,12 +94,25 @@ class Mapping:
                 [0.0, 1.0]
             ]
         )
+        self.transform_actual2exp = self.transform_exp2actual.copy()
+        self.translation_exp2actual = np.zeros(2)
+        # Measured stage positions [um] of wells, keyed by well name, for the affine calibration
+        self.fiducials = {}
+        self.calib_residuals_um = {}
         self.wells = {}
-
-        with open(array_file) as f:
-            self.plate_data = json.load(f)
-
-        # TODO save TL/BR locations in experiment savefile
+        self.well_index = {}
+        self.px_tree = None
+        self.um_tree = None
+        # Homogeneous 3x3 matrices from each frame to stage coords and back, see update_frames
+        self.to_stage = None
+        self.from_stage = None
+        self._frame_cache = {}
+        self._frame_inputs = None
+
+        self.array_file = os.path.abspath(array_file)
+        self.plate_data, self.well_names, self.well_coordinates = _read_array_file(
+            self.array_file, os.path.getmtime(self.array_file)
+        )
 
     @abstractmethod
     def set_calib_pts(self, pipettor_cfg=None):
@@ -57,9 +128,9 @@ class Mapping:
         self.um_center_to_corner_offset = self.um_TL[0:2]
 
         vector_actual = self.um_BR[0:2] - self.um_TL[0:2]
-        theta_actual = np.arctan(vector_actual[1] / vector_actual[0])
+        theta_actual = np.arctan2(vector_actual[1], vector_actual[0])
 
-        theta_expected = np.arctan(vector_expected[1] / vector_expected[0])
+        theta_expected = np.arctan2(vector_expected[1], vector_expected[0])
 
         theta_diff = theta_actual - theta_expected
         theta_transform = np.array(
@@ -79,7 +150,122 @@ class Mapping:
             ]
         )
 
-        self.transform_exp2actual = np.dot(theta_transform, scale_transform)
+        self.set_transform(np.dot(theta_transform, scale_transform))
+
+    def add_fiducial(self, well_name: str, abs_um_pos):
+        # Record the measured stage position [um] of a well center for calc_affine
+        self.fiducials[well_name] = np.asarray(abs_um_pos, dtype=float)[0:2]
+
+    def clear_fiducials(self):
+        self.fiducials = {}
+        self.calib_residuals_um = {}
+
+    def calc_affine(self, exp_rel_um, actual_abs_um, names=None):
+        # Least squares affine from expected rel pos [um] to actual rel pos [um]
+        # from three or more measured wells, allowing shear and non-uniform scaling
+        exp_rel_um = np.asarray(exp_rel_um, dtype=float).reshape(-1, 2)
+        actual_rel_um = self.abs_um_to_rel_um(np.asarray(actual_abs_um, dtype=float).reshape(-1, 2))
+        if exp_rel_um.shape[0] < 3:
+            raise ValueError(f'Affine calibration needs at least 3 wells, got {exp_rel_um.shape[0]}')
+
+        self.um_center_to_corner_offset = self.um_TL[0:2]
+
+        design = np.hstack((exp_rel_um, np.ones((exp_rel_um.shape[0], 1))))
+        if np.linalg.matrix_rank(design) < 3:
+            raise ValueError('Affine calibration wells must not all lie on one line')
+        affine, *_ = np.linalg.lstsq(design, actual_rel_um, rcond=None)
+
+        self.set_transform(affine[0:2], translation=affine[2])
+
+        residuals = actual_rel_um - self.exp_to_actual(exp_rel_um)
+        names = names if names is not None else range(exp_rel_um.shape[0])
+        self.calib_residuals_um = dict(zip(names, residuals))
+        err = np.linalg.norm(residuals, axis=1)
+        logging.info(f'Affine calibration from {len(err)} wells, residual RMS {np.sqrt(np.mean(err**2)):.1f} um, max {err.max():.1f} um')
+        for name, residual in self.calib_residuals_um.items():
+            logging.info(f'Calibration residual {name}: {residual}')
+
+        return residuals
+
+    def set_transform(self, transform, translation=None):
+        # Set the expected to actual transform and cache its inverse
+        self.transform_exp2actual = np.asarray(transform, dtype=float)
+        self.transform_actual2exp = np.linalg.inv(self.transform_exp2actual)
+        self.translation_exp2actual = np.zeros(2) if translation is None else np.asarray(translation, dtype=float)
+        self.to_stage = None
+
+    def update_frames(self):
+        # Precompose the frame changes into homogeneous 3x3 matrices for row vectors [x, y, 1],
+        # so any change of frame is a single matmul. Frames are
+        #   'exp': expected position relative to the first well [um]
+        #   'actual': actual position relative to the TL calibration point [um]
+        #   'stage': absolute stage position [um]
+        #   'px': mosaic image position [px]
+        exp_to_actual = np.eye(3)
+        exp_to_actual[0:2, 0:2] = self.transform_exp2actual
+        exp_to_actual[2, 0:2] = self.translation_exp2actual
+
+        actual_to_stage = np.eye(3)
+        actual_to_stage[2, 0:2] = self.um_TL[0:2]
+
+        px_to_actual = np.diag([self.px_sz_um, self.px_sz_um, 1.0])
+        px_to_actual[2, 0:2] = -self.px_center_to_corner_offset * self.px_sz_um
+
+        self.to_stage = {
+            'exp': exp_to_actual @ actual_to_stage,
+            'actual': actual_to_stage,
+            'stage': np.eye(3),
+            'px': px_to_actual @ actual_to_stage,
+        }
+        self.from_stage = {frame: np.linalg.inv(matrix) for frame, matrix in self.to_stage.items()}
+        self._frame_cache = {}
+        self._frame_inputs = self._frame_key()
+
+    def _frame_key(self):
+        # Values the frames are built from, the attributes are public and reassigned or
+        # updated in place (e.g. px_center_to_corner_offset in load_wells), so they are compared by value
+        return b''.join(
+            np.asarray(value, dtype=float).tobytes()
+            for value in (
+                self.transform_exp2actual,
+                self.translation_exp2actual,
+                self.um_TL[0:2],
+                self.px_center_to_corner_offset,
+                self.px_sz_um,
+            )
+        )
+
+    def _tile_to_stage(self, tile_um):
+        # Image px of the camera tile centered on stage position tile_um to stage coords
+        matrix = np.diag([self.px_sz_um, self.px_sz_um, 1.0])
+        matrix[2, 0:2] = np.asarray(tile_um, dtype=float)[0:2] - np.array([CAM_X_PX / 2, CAM_Y_PX / 2]) * self.px_sz_um
+
+        return matrix
+
+    def frame_matrix(self, src: str, dst: str, tile_um=None):
+        # Homogeneous 3x3 matrix taking row vector points from frame src to frame dst,
+        # the 'tile' frame is image px of the camera tile centered on stage position tile_um
+        if self.to_stage is None or self._frame_key() != self._frame_inputs:
+            self.update_frames()
+
+        if 'tile' not in (src, dst) and (src, dst) in self._frame_cache:
+            return self._frame_cache[(src, dst)]
+
+        to_stage = self._tile_to_stage(tile_um) if src == 'tile' else self.to_stage[src]
+        from_stage = np.linalg.inv(self._tile_to_stage(tile_um)) if dst == 'tile' else self.from_stage[dst]
+        matrix = to_stage @ from_stage
+        if 'tile' not in (src, dst):
+            self._frame_cache[(src, dst)] = matrix
+
+        return matrix
+
+    def transform(self, points, src: str, dst: str, tile_um=None):
+        # Transform points given as rows [[x1, y1], [x2, y2], ...] from frame src to frame dst
+        # in one matmul, see update_frames for the frames
+        points = np.asarray(points, dtype=float)
+        matrix = self.frame_matrix(src, dst, tile_um)
+
+        return points @ matrix[0:2, 0:2] + matrix[2, 0:2]
 
     def calc_crops(self, px_pos, px_padding=[0, 0]):
         width = int(round(
@@ -108,10 +294,10 @@ class Mapping:
 
         # Ideally, user has previously set transform
         # TODO: Add user prompt if not
-        return np.matmul(pos, self.transform_exp2actual)
+        return np.matmul(pos, self.transform_exp2actual) + self.translation_exp2actual
 
     def actual_to_exp(self, pos):
-        return np.matmul(pos, np.linalg.inv(self.transform_exp2actual))
+        return np.matmul(pos - self.translation_exp2actual, self.transform_actual2exp)
 
     def load_wells(self, grid_list=None, xflip=False, yflip=False, padding=[0,0]):
 
@@ -120,11 +306,11 @@ class Mapping:
             self.px_center_to_corner_offset += (um_TL_array_to_TL_mosaic / self.px_sz_um)
             
         # Load metadata
-        well_names = self.plate_data['wells']['well_names']
-        unformatted_well_pos = np.array(self.plate_data['wells']['well_coordinates'])
+        well_names = self.well_names
+        self.well_index = {name: i for i, name in enumerate(well_names)}
 
         # Format well positions
-        exp_rel_um = unformatted_well_pos.reshape(-1, 2)
+        exp_rel_um = self.well_coordinates
         vector_expected = np.max(exp_rel_um, axis=0)
 
         xI = -1 if xflip else 1
@@ -133,26 +319,98 @@ class Mapping:
         exp_rel_um = np.matmul(exp_rel_um, arrI)
         vector_expected = np.matmul(vector_expected, arrI)
 
-        self.calc_transform(vector_expected)
+        # Fit a full affine when enough wells were measured, else rotation and scale from the corners
+        fiducials = [name for name in self.fiducials if name in self.well_index]
+        if len(fiducials) >= 3:
+            ids = [self.well_index[name] for name in fiducials]
+            self.calc_affine(exp_rel_um[ids], [self.fiducials[name] for name in fiducials], names=fiducials)
+        else:
+            self.calc_transform(vector_expected)
 
         # Transform wells
-        actual_rel_um = self.exp_to_actual(exp_rel_um)
-        actual_abs_um = self.rel_um_to_abs_um(actual_rel_um)
-        px_pos = self.rel_um_to_px(actual_rel_um)
+        self.update_frames()
+        actual_abs_um = self.transform(exp_rel_um, 'exp', 'stage')
+        px_pos = self.transform(exp_rel_um, 'exp', 'px')
         px_crops = self.calc_crops(px_pos, px_padding=padding)
 
+        # Per well records in one structured array, indexed through a name lookup
+        table = np.zeros(
+            len(well_names),
+            dtype=[
+                ('name', f'U{max(len(name) for name in well_names)}'),
+                ('exp_rel_um', 'f8', 2),
+                ('actual_abs_um', 'f8', 2),
+                ('actual_px', 'f8', 2),
+                ('crop_px_coords', 'f8', 4),
+            ],
+        )
+        table['name'] = well_names
+        table['exp_rel_um'] = exp_rel_um
+        table['actual_abs_um'] = actual_abs_um
+        table['actual_px'] = px_pos
+        table['crop_px_coords'] = px_crops
+
+        self._set_wells(table)
+
+    def _set_wells(self, table):
         # Load sequence
+        self.px_tree = cKDTree(table['actual_px'])
+        self.um_tree = cKDTree(table['actual_abs_um'])
         self.wells = {
             'array_design' : self.plate_data['array_design'],
-            'names': well_names,
-            'exp_rel_um' : exp_rel_um,
-            "actual_abs_um": actual_abs_um,
-            "actual_px": px_pos, # NOTE px is unused for dispense plate, given in (x, y) coords
-            "crop_px_coords" : px_crops,
+            'names': self.well_names,
+            'table': table,
+            'exp_rel_um' : table['exp_rel_um'],
+            "actual_abs_um": table['actual_abs_um'],
+            "actual_px": table['actual_px'], # NOTE px is unused for dispense plate, given in (x, y) coords
+            "crop_px_coords" : table['crop_px_coords'],
+        }
+
+    def calibration_state(self):
+        # Calibration and transformed wells as arrays, to save and restore with restore_calibration
+        return {
+            'um_TL': self.um_TL,
+            'um_BR': self.um_BR,
+            'px_center_to_corner_offset': self.px_center_to_corner_offset,
+            'transform_exp2actual': self.transform_exp2actual,
+            'translation_exp2actual': self.translation_exp2actual,
+            'fiducial_names': np.array(list(self.fiducials), dtype=str),
+            'fiducial_um': np.array(list(self.fiducials.values()), dtype=float).reshape(-1, 2),
+            'wells': self.wells['table'],
         }
 
+    def restore_calibration(self, state):
+        # Restore a saved calibration without recomputing the transform or the wells
+        self.um_TL = np.array(state['um_TL'])
+        self.um_BR = np.array(state['um_BR'])
+        self.um_center_to_corner_offset = self.um_TL[0:2]
+        self.px_center_to_corner_offset = np.array(state['px_center_to_corner_offset'])
+        self.set_transform(state['transform_exp2actual'], translation=state['translation_exp2actual'])
+        if 'fiducial_names' in state:
+            self.fiducials = {str(name): np.array(pos) for name, pos in zip(state['fiducial_names'], state['fiducial_um'])}
+        self.update_frames()
+        self.well_index = {name: i for i, name in enumerate(self.well_names)}
+        self._set_wells(np.array(state['wells']))
+
     def get_well_id(self, well_name: str):
-        return self.wells['names'].index(well_name)
+        return self.well_index[well_name]
+
+    def get_well_ids(self, well_names):
+        # Indices of many wells at once, -1 for names not on the plate
+        return np.fromiter(
+            (self.well_index.get(name, -1) for name in well_names),
+            dtype=np.intp,
+            count=len(well_names),
+        )
+
+    def get_positions(self, well_names, offset=np.array([0, 0])):
+        # Stage coords [um] of a whole pick list as rows [[x1, y1], [x2, y2], ...],
+        # rows of names not on the plate are nan
+        ids = self.get_well_ids(list(well_names))
+        pos = self.wells['actual_abs_um'][ids] + offset
+        pos[ids < 0] = np.nan
+
+        return pos
 
     def get_abs_um_from_well_name(self, well_name: str):
         return self.wells['actual_abs_um'][self.get_well_id(well_name)]
@@ -160,11 +418,30 @@ class Mapping:
     def get_px_from_well_name(self, well_name: str):
         return self.wells['actual_px'][self.get_well_id(well_name)]
 
+    def find_well_ids(self, pos, px=True):
+        # Indices of the wells containing each position, -1 outside of all wells
+        # Positions are rows [[x1, y1], [x2, y2], ...] in image px, or stage um if px is False
+        pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        tree = self.px_tree if px else self.um_tree
+        design = self.plate_data['array_design']
+        scale = self.px_sz_um if px else 1.0
+        half_size = np.array([design['slot_length'], design['slot_width']]) / (2 * scale)
+
+        _, ids = tree.query(pos)
+        centers = self.wells['actual_px' if px else 'actual_abs_um'][ids]
+        if design['well_shape'] in ('circular_array', 'well_plate'):
+            inside = np.linalg.norm(pos - centers, axis=1) <= half_size[0]
+        else:
+            inside = np.all(np.abs(pos - centers) <= half_size, axis=1)
+
+        return np.where(inside, ids, -1)
+
     def _get_well_pos(self, well_name: str, offset):
-        if well_name not in self.wells['names']:
+        well_id = self.well_index.get(well_name)
+        if well_id is None:
             return
 
-        pos = self.wells['actual_abs_um'][self.get_well_id(well_name)]
+        pos = self.wells['actual_abs_um'][well_id]
         x = pos[0] + offset[0]
         y = pos[1] + offset[1]
 
@@ -188,9 +465,9 @@ class Mapping:
 
     def px_to_abs_um(self, px_pos):
         # Image coords to stage coords
-        return self.rel_um_to_abs_um(self.px_to_rel_um(px_pos))
+        return self.transform(px_pos, 'px', 'stage')
 
     def abs_um_to_px(self, abs_um_pos):
         # Stage coords to image coords
-        return self.rel_um_to_px(self.abs_um_to_rel_um(abs_um_pos))
+        return self.transform(abs_um_pos, 'stage', 'px')
 
@@ -1,15 +1,20 @@
+import concurrent.futures
+import functools
 import logging
 import numpy as np
-import matplotlib.pyplot as plt
+import re
 
 from itertools import product
+from pathlib import Path
+from scipy import ndimage
 from time import perf_counter
 from tqdm import tqdm
 from typing import cast
 from useq import MDASequence, Position, GridFromEdges
 from useq._iter_sequence import _used_axes, _iter_axis, _parse_axes
 
-from fish_sorter.constants import CAM_X_PX, CAM_Y_PX, MIRROR_X
+from fish_sorter.constants import CAM_X_PX, CAM_Y_PX, FLATFIELD_CORRECT, MIRROR_X, REGISTER_TILES, STITCH_WORKERS
+from fish_sorter.helpers.registration import TileRegistration, registration_key
 
 # TODO is there an easier way to get the mosaic positions?
 
@@ -24,11 +29,96 @@ except ImportError:
 
 DEFAULT_NAME = "Exp"
 
+# Measured flat-fields belong to the instrument, not to an experiment
+FLATFIELD_DIR = Path.home() / ".fish_sorter" / "flatfield"
+
+
+def full_res(layer):
+    """Full resolution data of a napari image layer, which may be multiscale
+
+    :param layer: napari image layer
+    :type layer: napari.layers.Image
+
+    :return: full resolution image data
+    :rtype: array-like
+    """
+
+    if getattr(layer, 'multiscale', False):
+        return layer.data[0]
+    return layer.data
+
+
+def grid_index(sequence: MDASequence):
+    """Grid index of the mosaic
+
+    grid_list[col, row] holds the position index g and the (x, y) stage position of each
+    tile, with cols and rows in ascending stage x and y. For a GridFromEdges plan this is
+    derived from the plan's grid positions without iterating the MDA events, and memoized
+    by the plan's value, since every MDA widget value is a new sequence.
+
+    :param sequence: MDA sequence with a grid plan
+    :type sequence: MDASequence
+
+    :return: read-only grid_list shaped (num_cols, num_rows, 3), num_rows, num_cols
+    :rtype: np.ndarray, int, int
+    """
+
+    if isinstance(sequence.grid_plan, GridFromEdges):
+        return plan_grid_index(sequence.grid_plan.model_dump_json())
+
+    # Get position at each id
+    event_iterator = sequence.iter_events()
+    pos_list = np.unique([[event.index['g'], event.x_pos, event.y_pos] for event in event_iterator], axis=0)
+    xpos_list, x_ids = np.unique(pos_list[:,1], return_inverse=True)
+    ypos_list, y_ids = np.unique(pos_list[:,2], return_inverse=True)
+    num_rows = len(ypos_list)
+    num_cols = len(xpos_list)
+
+    # Save order of positions
+    grid_list = np.zeros((num_cols, num_rows, 3), dtype=int)
+    grid_list[x_ids, y_ids] = pos_list
+    grid_list.flags.writeable = False
+
+    return grid_list, num_rows, num_cols
+
+
+@functools.lru_cache(maxsize=8)
+def plan_grid_index(plan_json: str):
+    """Grid index of a GridFromEdges plan, memoized by the plan's JSON
+
+    The grid only depends on the plan, not on the channels or the rest of the sequence
+
+    :param plan_json: GridFromEdges.model_dump_json() of the plan
+    :type plan_json: str
+
+    :return: read-only grid_list shaped (num_cols, num_rows, 3), num_rows, num_cols
+    :rtype: np.ndarray, int, int
+    """
+
+    plan = GridFromEdges.model_validate_json(plan_json)
+    # Positions in acquisition order, plan rows run from the top edge downwards in stage y
+    positions = np.array([[pos.row, pos.col, pos.x, pos.y] for pos in plan.iter_grid_positions()])
+    rows = positions[:, 0].astype(int)
+    cols = positions[:, 1].astype(int)
+    num_rows = int(rows.max()) + 1
+    num_cols = int(cols.max()) + 1
+
+    # grid_list rows ascend in stage y
+    grid_list = np.zeros((num_cols, num_rows, 3), dtype=int)
+    grid_list[cols, (num_rows - 1) - rows, 0] = np.arange(len(positions))
+    grid_list[cols, (num_rows - 1) - rows, 1] = positions[:, 2]
+    grid_list[cols, (num_rows - 1) - rows, 2] = positions[:, 3]
+    grid_list.flags.writeable = False
+
+    return grid_list, num_rows, num_cols
+
 
 class Mosaic:
     def __init__(self, viewer):
         self.viewer = viewer
         self.grid_list = None
+        self.registration = TileRegistration()
+        self.flatfield = FlatField()
 
     @staticmethod
     def get_sequence(grid_plan):
@@ -114,120 +204,684 @@ class Mosaic:
     @staticmethod
     def get_grid_list(sequence):
         """Get mosaic info from the MDASequence metadata"""
-        # General metadata
-        num_chan = len(sequence.channels)
-        logging.info(f'num_chan: {num_chan}')
-        chan_names = [channel.config for channel in sequence.channels]
-        logging.info(f'chan_nam: {chan_names}')
-        overlap = sequence.grid_plan.overlap
-        logging.info(f'overlap: {overlap}')
-
-        # Get position at each id
-        event_iterator = sequence.iter_events()
-        pos_list = np.unique([[event.index['g'], event.x_pos, event.y_pos] for event in event_iterator], axis=0)
-        xpos_list, x_ids = np.unique(pos_list[:,1], return_inverse=True)
-        ypos_list, y_ids = np.unique(pos_list[:,2], return_inverse=True)
-        num_rows = len(np.unique(pos_list[:,2]))
-        num_cols = len(np.unique(pos_list[:,1]))
-
-        # Save order of positions
-        grid_list = np.zeros((num_cols, num_rows, 3), dtype=int)
-        for grid_pos, y_id, x_id in zip(pos_list, y_ids, x_ids):
-            grid_list[x_id, y_id] = grid_pos
 
-        return grid_list
+        return grid_index(sequence)[0]
 
     def get_mosaic_metadata(self, sequence: MDASequence):
         """Get mosaic info from the MDASequence metadata"""
         # General metadata
         num_chan = len(sequence.channels)
-        logging.info(f'num_chan: {num_chan}')
         chan_names = [channel.config for channel in sequence.channels]
-        logging.info(f'chan_nam: {chan_names}')
         overlap = sequence.grid_plan.overlap
-        logging.info(f'overlap: {overlap}')
+        logging.info(f'num_chan: {num_chan}, chan_names: {chan_names}, overlap: {overlap}')
 
-        # Get position at each id
-        event_iterator = sequence.iter_events()
-        pos_list = np.unique([[event.index['g'], event.x_pos, event.y_pos] for event in event_iterator], axis=0)
-        xpos_list, x_ids = np.unique(pos_list[:,1], return_inverse=True)
-        ypos_list, y_ids = np.unique(pos_list[:,2], return_inverse=True)
-        num_rows = len(np.unique(pos_list[:,2]))
-        num_cols = len(np.unique(pos_list[:,1]))
-
-        # Save order of positions
-        self.grid_list = np.zeros((num_cols, num_rows, 3), dtype=int)
-        for grid_pos, y_id, x_id in zip(pos_list, y_ids, x_ids):
-            self.grid_list[x_id, y_id] = grid_pos
+        self.grid_list, num_rows, num_cols = grid_index(sequence)
 
         return num_rows, num_cols, num_chan, chan_names, overlap
 
-    def get_img(self, zarr, row, col, mirror_x = MIRROR_X):
-        """Get img for a given row and column"""
+    def get_img(self, zarr, row, col, chan=None, mirror_x = MIRROR_X, correction=None):
+        """Get img for a given row and column, optionally for a single channel
+        corrected by a (flat, dark) pair from FlatField"""
         idx = int(self.grid_list[col, row, 0])
-        img = zarr[0, idx, :, :, :]
+        if chan is None:
+            img = zarr[0, idx, :, :, :]
+        else:
+            img = zarr[0, idx, chan, :, :]
+        if correction is not None:
+            img = FlatField.apply(img, *correction)
         if mirror_x:
-            return np.flip(img, axis=2)
+            return np.flip(img, axis=-1)
         else:
             return img
 
-    def stitch_mosaic(self, sequence : MDASequence, img_arr):
+    @staticmethod
+    def tile_offsets(num_rows, num_cols, overlap):
+        """Nominal top left pixel of every tile in the unflipped mosaic
+
+        :param num_rows: number of grid rows
+        :type num_rows: int
+        :param num_cols: number of grid columns
+        :type num_cols: int
+        :param overlap: grid overlap in percent as (x, y)
+        :type overlap: tuple
+
+        :return: y and x start of each tile, each shaped (num_rows, num_cols), and the mosaic (y, x) shape
+        :rtype: np.ndarray, np.ndarray, tuple
+        """
+
+        x_overlap = int(CAM_X_PX * overlap[0] / 100.0)
+        y_overlap = int(CAM_Y_PX * overlap[1] / 100.0)
+        x_translation = CAM_X_PX - x_overlap
+        y_translation = CAM_Y_PX - y_overlap
+
+        y_starts, x_starts = np.meshgrid(
+            np.arange(num_rows) * y_translation,
+            np.arange(num_cols) * x_translation,
+            indexing='ij'
+        )
+        mosaic_x_dim = int((CAM_X_PX * num_cols) - (x_overlap * (num_cols - 1)))
+        mosaic_y_dim = int((CAM_Y_PX * num_rows) - (y_overlap * (num_rows - 1)))
+
+        return y_starts, x_starts, (mosaic_y_dim, mosaic_x_dim)
+
+    @staticmethod
+    def coverage_weights(y_starts, x_starts, shape):
+        """Per-pixel count of the tiles covering each mosaic pixel
+
+        Uncovered pixels are given a weight of 1 so the map can be divided by directly
+
+        :param y_starts: top pixel of each tile
+        :type y_starts: np.ndarray
+        :param x_starts: left pixel of each tile
+        :type x_starts: np.ndarray
+        :param shape: mosaic (y, x) shape
+        :type shape: tuple
+
+        :return: weight map
+        :rtype: np.ndarray
+        """
+
+        weights = np.zeros(shape, dtype=np.uint8)
+        for y_start, x_start in zip(y_starts.ravel(), x_starts.ravel()):
+            weights[y_start : y_start + CAM_Y_PX, x_start : x_start + CAM_X_PX] += 1
+        np.maximum(weights, 1, out=weights)
+
+        return weights
+
+    def tile_layout(self, arr_data, num_rows, num_cols, overlap, register=REGISTER_TILES, reg_chan=0, correction=None):
+        """Top left pixel of every tile in the unflipped mosaic, nominal or registered
+
+        Requires grid_list to be set by get_mosaic_metadata
+
+        :return: y and x start of each tile, each shaped (num_rows, num_cols), and the mosaic (y, x) shape
+        :rtype: np.ndarray, np.ndarray, tuple
+        """
+
+        y_starts, x_starts, mosaic_shape = self.tile_offsets(num_rows, num_cols, overlap)
+        if register:
+            logging.info("Registering tiles")
+            # The corner tiles are sampled so another plate on the same grid is registered again
+            corners = (int(self.grid_list[0, 0, 0]), int(self.grid_list[-1, -1, 0]))
+            samples = [np.asarray(arr_data[0, idx, reg_chan, ::64, ::64]) for idx in corners]
+            key = registration_key(self.grid_list, overlap, (CAM_Y_PX, CAM_X_PX), samples)
+            y_starts, x_starts = self.registration.register(
+                lambda row, col: self.get_img(arr_data, row, (num_cols - 1) - col, reg_chan, correction=correction),
+                y_starts,
+                x_starts,
+                (CAM_Y_PX, CAM_X_PX),
+                key,
+            )
+            mosaic_shape = (int(y_starts.max()) + CAM_Y_PX, int(x_starts.max()) + CAM_X_PX)
+
+        return y_starts, x_starts, mosaic_shape
+
+    def _stitch_channel(self, arr_data, chan, y_starts, x_starts, weights, correction=None):
+        """Accumulate every tile of one channel and normalize once by the weight map
+
+        Tiles are summed into a uint32 buffer so overlapping bright tiles cannot wrap around.
+        With a (flat, dark) correction, each tile is flat-field corrected as it is read
+
+        :return: unflipped mosaic of the channel, averaged in the overlaps
+        :rtype: np.ndarray
+        """
+
+        num_rows, num_cols = y_starts.shape
+        accum = np.zeros(weights.shape, dtype=np.uint32)
+        for row, col in tqdm(np.ndindex(num_rows, num_cols), total=num_rows * num_cols, desc=f"Channel {chan}", position=chan):
+            y_start = y_starts[row, col]
+            x_start = x_starts[row, col]
+            mirrored_col = (num_cols - 1) - col
+            accum[y_start : y_start + CAM_Y_PX, x_start : x_start + CAM_X_PX] += self.get_img(arr_data, row, mirrored_col, chan, correction=correction)
+        np.floor_divide(accum, weights, out=accum)
+
+        return accum
+
+    def stitch_mosaic(self, sequence : MDASequence, img_arr, register=REGISTER_TILES, reg_chan=0, correct=FLATFIELD_CORRECT, objective=None, max_workers=STITCH_WORKERS):
         """
         Stitch mosaic from MDA sequence and image array.
 
+        Each channel is accumulated in a wider buffer with a per-pixel weight map and
+        normalized once, so overlaps are averaged without overflowing.
+        With register, tile positions are refined by phase correlation of the
+        overlaps in reg_chan instead of only using the nominal grid.
+        With correct, tiles are flat-field and dark-frame corrected per channel using
+        the flat-fields calibrated for the objective, estimated from the tiles if missing.
+        Channels are stitched concurrently by up to max_workers threads, each holding
+        one channel accumulator.
+
         Returns 3D array which can be indexed by (channel, y, x)
         """
         # Get metadata
-        dir = self.get_dir(sequence)
         num_rows, num_cols, num_channels, chan_names, overlap = self.get_mosaic_metadata(sequence)
 
-        # Compute key distances
-        x_overlap = int(CAM_X_PX * overlap[0] / 100.0)
-        y_overlap = int(CAM_Y_PX * overlap[1] / 100.0)
-        x_translation = CAM_X_PX - x_overlap
-        y_translation = CAM_Y_PX - y_overlap
-
         # Get zarr array
         arr_data = self.viewer.layers[-1].data
         dtype = arr_data.dtype
 
         # TODO check that array has same dims as mosaic?
 
-        # Initialize empty mosaic
-        mosaic_x_dim = int((CAM_X_PX * num_cols) - (x_overlap * (num_cols - 1)))
-        mosaic_y_dim = int((CAM_Y_PX * num_rows) - (y_overlap * (num_rows - 1)))
-        mosaic = np.zeros((num_channels, mosaic_y_dim, mosaic_x_dim), dtype=np.uint16)
-
-        # Assemble mosaic
-        logging.info("Stitching images together")
-        for row in tqdm(range(num_rows), desc="Row"):
-            y_start = int(row * y_translation)
-            for col in tqdm(range(num_cols), desc="Column"):
-                x_start = int(col * x_translation)
-                mirrored_col = (num_cols - 1) - col
-                mosaic[:, y_start : y_start + CAM_Y_PX, x_start : x_start + CAM_X_PX] += self.get_img(arr_data, row, mirrored_col)
-
-        # Take average of overlapping areas
-        logging.info("Taking average of overlapping areas")
-        for row in tqdm(range(1, num_rows), desc="Row"):
-            y_start = int(row * y_translation)
-            mosaic[:, y_start : y_start - y_translation + CAM_Y_PX, :] = np.floor_divide(
-                mosaic[:, y_start : y_start - y_translation + CAM_Y_PX, :],
-                2
-            ).astype(np.uint16)
-        for col in tqdm(range(1, num_cols), desc="Column"):
-            x_start = int(col * x_translation)
-            mosaic[:, :, x_start : x_start - x_translation + CAM_X_PX] = np.floor_divide(
-                mosaic[:, :, x_start : x_start - x_translation + CAM_X_PX],
-                2
-            ).astype(np.uint16)
-
-        mosaic = np.flip(mosaic, axis=2)
-        return mosaic.astype(dtype)
+        corrections = [None] * num_channels
+        if correct:
+            tile_ids = self.grid_list[:, :, 0].ravel()
+            corrections = [
+                self.flatfield.get(arr_data, chan, chan_name, objective, tile_ids)
+                for chan, chan_name in enumerate(chan_names)
+            ]
+
+        y_starts, x_starts, mosaic_shape = self.tile_layout(
+            arr_data, num_rows, num_cols, overlap, register, reg_chan, corrections[reg_chan]
+        )
+        weights = self.coverage_weights(y_starts, x_starts, mosaic_shape)
+        mosaic = np.zeros((num_channels, *mosaic_shape), dtype=dtype)
+
+        def _assemble(chan):
+            mosaic[chan] = self._stitch_channel(arr_data, chan, y_starts, x_starts, weights, corrections[chan])[:, ::-1]
+
+        logging.info(f"Stitching images together with {max_workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # list() re-raises any exception from the workers
+            list(pool.map(_assemble, range(num_channels)))
+
+        return mosaic
+
+    def virtual_mosaic(self, sequence : MDASequence, arr_data, register=REGISTER_TILES, reg_chan=0, correct=FLATFIELD_CORRECT, objective=None, min_size=1024):
+        """Lazy multiscale mosaic of every channel, computed from the tiles on demand
+
+        The tile layout is registered once for all channels. With correct, each tile is flat-field
+        and dark-frame corrected as it is read, with the same corrections as stitch_mosaic
+
+        :param sequence: MDA sequence of the acquired tiles
+        :type sequence: MDASequence
+        :param arr_data: acquired tiles indexed by (p, g, c, y, x)
+        :type arr_data: zarr.Array
+        :param min_size: smallest edge length in pixels of the coarsest level
+        :type min_size: int
+
+        :return: per channel the virtual mosaic levels, starting at full resolution
+        :rtype: list of list of VirtualMosaic
+        """
+
+        num_rows, num_cols, num_channels, chan_names, overlap = self.get_mosaic_metadata(sequence)
+
+        corrections = [None] * num_channels
+        if correct:
+            tile_ids = self.grid_list[:, :, 0].ravel()
+            corrections = [
+                self.flatfield.get(arr_data, chan, chan_name, objective, tile_ids)
+                for chan, chan_name in enumerate(chan_names)
+            ]
+        y_starts, x_starts, mosaic_shape = self.tile_layout(
+            arr_data, num_rows, num_cols, overlap, register, reg_chan, corrections[reg_chan]
+        )
+
+        # Grid tile of each unflipped mosaic position, and its start once the mosaic is flipped
+        tile_ids = self.grid_list[::-1, :, 0].T
+        x_starts = mosaic_shape[1] - x_starts - CAM_X_PX
+
+        mosaics = []
+        for chan in range(num_channels):
+            levels = [VirtualMosaic(arr_data, chan, tile_ids, y_starts, x_starts, mosaic_shape, correction=corrections[chan])]
+            while min(levels[-1].shape) // 2 >= min_size:
+                levels.append(VirtualMosaic(
+                    arr_data, chan, tile_ids, y_starts, x_starts, mosaic_shape, 2**len(levels), correction=corrections[chan]
+                ))
+            mosaics.append(levels)
+
+        return mosaics
+
+    @staticmethod
+    def build_pyramid(image, min_size=1024):
+        """Multi-resolution pyramid of a mosaic for display
+
+        Each level takes every second pixel of the last two axes of the previous one, the same
+        as the levels of a VirtualMosaic, until the next level would be smaller than min_size
+
+        :param image: full resolution mosaic, e.g. a single channel (y, x)
+        :type image: np.ndarray
+        :param min_size: smallest edge length in pixels of the coarsest level
+        :type min_size: int
+
+        :return: pyramid levels, starting with the full resolution image
+        :rtype: list of np.ndarray
+        """
+
+        levels = [image]
+        while min(levels[-1].shape[-2:]) // 2 >= min_size:
+            levels.append(levels[-1][..., ::2, ::2])
+
+        return levels
 
     def display_mosaic(self, mosaic):
         """Display mosaic as a napari layer"""
         # Convert into array
         # Create image layer
         # TODO put mosaic in napari viewer
-        pass
\ No newline at end of file
+        pass
+
+class FlatField:
+    """Per channel flat-field and dark-frame correction of the tiles
+
+    Flat-fields measured with calibrate are stored on disk keyed by channel config and objective.
+    Without a calibration the flat-field is estimated from the acquired tiles as their median,
+    which only holds for that plate, so estimates are never stored.
+    """
+
+    def __init__(self, cache_dir=FLATFIELD_DIR, max_tiles=32, bin_px=8, sigma=4.0):
+        """
+        :param cache_dir: directory of the calibrated flat-fields, None to only keep them in memory
+        :type cache_dir: Path
+        :param max_tiles: most tiles sampled when estimating a flat-field from the tiles
+        :type max_tiles: int
+        :param bin_px: tiles are estimated on a grid of this pixel stride, then upsampled
+        :type bin_px: int
+        :param sigma: gaussian smoothing of the binned estimate, in bins
+        :type sigma: float
+        """
+
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_tiles = max_tiles
+        self.bin_px = bin_px
+        self.sigma = sigma
+        self._cache = {}
+
+    @staticmethod
+    def key(chan_config, objective):
+        """Filename safe cache key of a channel config and objective"""
+
+        return re.sub(r'[^A-Za-z0-9.-]+', '_', f'{objective}_{chan_config}')
+
+    def load(self, chan_config, objective):
+        """Calibrated (flat, dark) pair of a channel config and objective, None if missing"""
+
+        key = self.key(chan_config, objective)
+        if key in self._cache:
+            return self._cache[key]
+        if self.cache_dir is not None:
+            cache_file = self.cache_dir / f'{key}.npz'
+            if cache_file.exists():
+                with np.load(cache_file) as cached:
+                    self._cache[key] = (cached['flat'], cached['dark'])
+                logging.info(f'Loaded flat-field {cache_file}')
+                return self._cache[key]
+        return None
+
+    def save(self, chan_config, objective, flat, dark):
+        """Store a calibrated (flat, dark) pair in memory and on disk"""
+
+        key = self.key(chan_config, objective)
+        self._cache[key] = (flat, dark)
+        if self.cache_dir is not None:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                np.savez_compressed(self.cache_dir / f'{key}.npz', flat=flat, dark=dark)
+            except OSError as e:
+                logging.warning(f'Could not write flat-field cache: {e}')
+
+    def calibrate(self, chan_config, objective, flat_frames, dark_frames=None):
+        """Store a flat-field measured from dedicated frames, e.g. of a uniform slide
+
+        :param chan_config: channel config the frames were taken with
+        :type chan_config: str
+        :param objective: objective label
+        :type objective: str
+        :param flat_frames: frames of a uniformly illuminated sample (n, y, x)
+        :type flat_frames: np.ndarray
+        :param dark_frames: frames with the light path closed (n, y, x), None for no dark offset
+        :type dark_frames: np.ndarray
+
+        :return: flat-field normalized to a mean of 1 and the dark frame
+        :rtype: np.ndarray, np.ndarray
+        """
+
+        dark = np.zeros(flat_frames.shape[1:], dtype=np.float32)
+        if dark_frames is not None:
+            dark = np.mean(dark_frames, axis=0, dtype=np.float32)
+        flat = np.mean(flat_frames, axis=0, dtype=np.float32) - dark
+        flat = self._normalize(ndimage.gaussian_filter(flat, self.sigma * self.bin_px))
+        self.save(chan_config, objective, flat, dark)
+
+        return flat, dark
+
+    def estimate(self, arr_data, chan, tile_ids):
+        """Estimate a flat-field as the median over the acquired tiles of one channel
+
+        Sparse samples of the plate are mostly background, so the median follows the illumination.
+        The median is taken on a binned grid, smoothed and upsampled to the tile size.
+
+        :param arr_data: acquired tiles indexed by (p, g, c, y, x)
+        :type arr_data: zarr.Array
+        :param chan: channel index
+        :type chan: int
+        :param tile_ids: grid position indices to sample
+        :type tile_ids: np.ndarray
+
+        :return: flat-field normalized to a mean of 1
+        :rtype: np.ndarray
+        """
+
+        tile_ids = np.asarray(tile_ids).ravel()
+        if len(tile_ids) > self.max_tiles:
+            tile_ids = tile_ids[np.linspace(0, len(tile_ids) - 1, self.max_tiles).astype(int)]
+        b = self.bin_px
+        samples = np.stack([np.asarray(arr_data[0, int(idx), chan, ::b, ::b]) for idx in tile_ids])
+        binned = np.median(samples, axis=0).astype(np.float32)
+        binned = ndimage.gaussian_filter(binned, self.sigma)
+        zoom = (CAM_Y_PX / binned.shape[0], CAM_X_PX / binned.shape[1])
+        flat = ndimage.zoom(binned, zoom, order=1)[:CAM_Y_PX, :CAM_X_PX]
+
+        return self._normalize(flat)
+
+    def get(self, arr_data, chan, chan_config, objective, tile_ids):
+        """Calibrated (flat, dark) pair of the channel, or a flat-field estimated from these tiles
+        without a dark offset if it was never calibrated"""
+
+        calibrated = self.load(chan_config, objective)
+        if calibrated is not None:
+            return calibrated
+
+        logging.info(f'No {chan_config} flat-field calibration for {objective}, estimating it from the tiles')
+        flat = self.estimate(arr_data, chan, tile_ids)
+
+        return flat, np.zeros_like(flat)
+
+    @staticmethod
+    def _normalize(flat):
+        """Scale a flat-field to a mean of 1, guarding against zero pixels"""
+
+        flat = np.maximum(flat, np.finfo(np.float32).eps)
+        return (flat / flat.mean()).astype(np.float32)
+
+    @staticmethod
+    def apply(img, flat, dark):
+        """Correct a tile (or a stack of tiles) as (img - dark) / flat
+
+        :return: corrected image, clipped to the range of the input dtype
+        :rtype: np.ndarray
+        """
+
+        img = np.asarray(img)
+        corrected = np.subtract(img, dark, dtype=np.float32)
+        corrected /= flat
+        if np.issubdtype(img.dtype, np.integer):
+            info = np.iinfo(img.dtype)
+            np.clip(corrected, info.min, info.max, out=corrected)
+            np.rint(corrected, out=corrected)
+
+        return corrected.astype(img.dtype)
+
+
+class VirtualMosaic:
+    """Read-only, array-like single channel mosaic that is never held in memory
+
+    Any requested region is assembled on demand from the tiles that intersect it,
+    averaging the overlaps, so napari multiscale layers and well crops only read the
+    tiles they show. A downsampled level takes every factor-th pixel of the mosaic.
+    """
+
+    def __init__(self, arr_data, chan, tile_ids, y_starts, x_starts, mosaic_shape, factor=1, mirror_x=MIRROR_X, correction=None):
+        """
+        :param arr_data: acquired tiles indexed by (p, g, c, y, x)
+        :type arr_data: zarr.Array
+        :param chan: channel index
+        :type chan: int
+        :param tile_ids: grid position index of each tile
+        :type tile_ids: np.ndarray
+        :param y_starts: top pixel of each tile in the mosaic
+        :type y_starts: np.ndarray
+        :param x_starts: left pixel of each tile in the (flipped) mosaic
+        :type x_starts: np.ndarray
+        :param mosaic_shape: full resolution (y, x) shape of the mosaic
+        :type mosaic_shape: tuple
+        :param factor: downsampling factor of this level
+        :type factor: int
+        :param mirror_x: whether tiles are mirrored before stitching
+        :type mirror_x: bool
+        :param correction: (flat, dark) pair from FlatField applied to each tile as it is read, None to not correct
+        :type correction: tuple
+        """
+
+        self.arr_data = arr_data
+        self.correction = correction
+        self.chan = chan
+        self.tile_ids = np.asarray(tile_ids).ravel()
+        self.y_starts = np.asarray(y_starts).ravel()
+        self.x_starts = np.asarray(x_starts).ravel()
+        self.factor = factor
+        # The mosaic is flipped in x after stitching, which un-mirrors mirrored tiles
+        self.reverse_x = not mirror_x
+        self.shape = (-(-mosaic_shape[0] // factor), -(-mosaic_shape[1] // factor))
+        self.dtype = arr_data.dtype
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        region = self._region(0, self.shape[0], 0, self.shape[1])
+        return region if dtype is None else region.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1 :]
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        bounds = []
+        post = []
+        for k, size in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step < 0:
+                    start, stop = stop + 1, start + 1
+                bounds.append((start, max(stop, start)))
+                post.append(slice(None, None, step) if step != 1 else slice(None))
+            else:
+                k = int(k) + size if int(k) < 0 else int(k)
+                if not 0 <= k < size:
+                    raise IndexError(f'index {k} is out of bounds for size {size}')
+                bounds.append((k, k + 1))
+                post.append(0)
+
+        (y0, y1), (x0, x1) = bounds
+        region = self._region(y0, y1, x0, x1)
+
+        return region[tuple(post)]
+
+    def _axis_samples(self, start, stop, tile_start, tile_len):
+        """Level pixels [i0, i1) inside one tile along an axis, and the tile pixel of i0"""
+
+        f = self.factor
+        i0 = max(start, -(-tile_start // f))
+        i1 = min(stop, -(-(tile_start + tile_len) // f))
+
+        return i0, i1, i0 * f - tile_start
+
+    def _region(self, y0, y1, x0, x1):
+        """Assemble the region [y0, y1) x [x0, x1) of this level from the tiles"""
+
+        f = self.factor
+        accum = np.zeros((y1 - y0, x1 - x0), dtype=np.uint32)
+        weights = np.zeros(accum.shape, dtype=np.uint8)
+
+        hits = np.nonzero(
+            (self.y_starts < y1 * f) & (self.y_starts + CAM_Y_PX > y0 * f)
+            & (self.x_starts < x1 * f) & (self.x_starts + CAM_X_PX > x0 * f)
+        )[0]
+        for hit in hits:
+            iy0, iy1, ty = self._axis_samples(y0, y1, self.y_starts[hit], CAM_Y_PX)
+            ix0, ix1, tx = self._axis_samples(x0, x1, self.x_starts[hit], CAM_X_PX)
+            if iy1 <= iy0 or ix1 <= ix0:
+                continue
+            ny, nx = iy1 - iy0, ix1 - ix0
+            ys = slice(ty, ty + (ny - 1) * f + 1, f)
+            if self.reverse_x:
+                # Mosaic pixel tx + k is tile pixel CAM_X_PX - 1 - (tx + k)
+                last = CAM_X_PX - 1 - (tx + (nx - 1) * f)
+                xs = slice(last, last + (nx - 1) * f + 1, f)
+            else:
+                xs = slice(tx, tx + (nx - 1) * f + 1, f)
+            tile = np.asarray(self.arr_data[0, int(self.tile_ids[hit]), self.chan, ys, xs])
+            if self.correction is not None:
+                flat, dark = self.correction
+                tile = FlatField.apply(tile, flat[ys, xs], dark[ys, xs])
+            if self.reverse_x:
+                tile = tile[:, ::-1]
+            accum[iy0 - y0 : iy1 - y0, ix0 - x0 : ix1 - x0] += tile
+            weights[iy0 - y0 : iy1 - y0, ix0 - x0 : ix1 - x0] += 1
+
+        np.maximum(weights, 1, out=weights)
+        np.floor_divide(accum, weights, out=accum)
+
+        return accum.astype(self.dtype)
+
+
+class StreamingMosaic:
+    """Stitch the mosaic while the MDA is acquiring
+
+    Each frame emitted by the MDA runner is pasted into a preallocated accumulator
+    at its grid position, so the mosaic only needs to be normalized once the
+    sequence finishes. Only depends on the core's MDA events, so a simulated core
+    drives it the same as the instrument.
+    """
+
+    def __init__(self, mmc):
+        """
+        :param mmc: pymmcore-plus core whose MDA runner emits the frames
+        :type mmc: CMMCorePlus
+        """
+
+        self.mmc = mmc
+        self._reset()
+
+    def _reset(self):
+        """Clear the state of the current acquisition"""
+
+        self.sequence = None
+        self.mosaic = None
+        self._accum = None
+        self._weights = None
+        self._tile_pos = {}
+        self._dtype = None
+        self._frames = 0
+        self._expected = 0
+
+    def connect(self):
+        """Subscribe to the MDA events"""
+
+        self.mmc.mda.events.sequenceStarted.connect(self.start)
+        self.mmc.mda.events.frameReady.connect(self.add_frame)
+        self.mmc.mda.events.sequenceCanceled.connect(self.cancel)
+        self.mmc.mda.events.sequenceFinished.connect(self.finish)
+
+    def disconnect(self):
+        """Unsubscribe from the MDA events"""
+
+        self.mmc.mda.events.sequenceStarted.disconnect(self.start)
+        self.mmc.mda.events.frameReady.disconnect(self.add_frame)
+        self.mmc.mda.events.sequenceCanceled.disconnect(self.cancel)
+        self.mmc.mda.events.sequenceFinished.disconnect(self.finish)
+
+    def start(self, sequence: MDASequence, meta=None):
+        """Preallocate the mosaic for the sequence about to be acquired
+
+        :param sequence: MDA sequence being started
+        :type sequence: MDASequence
+        :param meta: summary metadata from the MDA runner, unused
+        :type meta: dict
+        """
+
+        self._reset()
+        if not isinstance(sequence.grid_plan, GridFromEdges):
+            logging.info('Sequence has no edge bounded grid plan, not streaming the mosaic')
+            return
+
+        grid_list = Mosaic.get_grid_list(sequence)
+        num_cols, num_rows = grid_list.shape[:2]
+        y_starts, x_starts, mosaic_shape = Mosaic.tile_offsets(num_rows, num_cols, sequence.grid_plan.overlap)
+
+        # Position index to its row and mirrored column in the unflipped mosaic
+        for col, row in np.ndindex(num_cols, num_rows):
+            mirrored_col = (num_cols - 1) - col
+            self._tile_pos[int(grid_list[col, row, 0])] = (y_starts[row, mirrored_col], x_starts[row, mirrored_col])
+
+        self._weights = Mosaic.coverage_weights(y_starts, x_starts, mosaic_shape)
+        self._accum = np.zeros((max(len(sequence.channels), 1), *mosaic_shape), dtype=np.uint32)
+        self._expected = len(self._tile_pos) * self._accum.shape[0]
+        self.sequence = sequence
+        logging.info(f'Streaming mosaic of {num_rows} rows, {num_cols} columns, {self._accum.shape[0]} channels')
+
+    def add_frame(self, img: np.ndarray, event, meta=None):
+        """Paste a single acquired tile into the mosaic
+
+        :param img: acquired tile
+        :type img: np.ndarray
+        :param event: MDA event of the tile, providing the g and c indices
+        :type event: useq.MDAEvent
+        :param meta: frame metadata from the MDA runner, unused
+        :type meta: dict
+        """
+
+        if self._accum is None:
+            return
+
+        g = event.index.get('g', 0)
+        if g not in self._tile_pos:
+            logging.info(f'Frame at position {g} is outside the streaming mosaic')
+            return
+        chan = event.index.get('c', 0)
+
+        y_start, x_start = self._tile_pos[g]
+        if MIRROR_X:
+            img = np.flip(img, axis=-1)
+        self._accum[chan, y_start : y_start + CAM_Y_PX, x_start : x_start + CAM_X_PX] += img
+        self._dtype = img.dtype
+        self._frames += 1
+
+    def cancel(self, sequence=None):
+        """Drop the partial mosaic of a canceled acquisition"""
+
+        logging.info('Streaming mosaic canceled')
+        self._reset()
+
+    def finish(self, sequence=None):
+        """Normalize the accumulated tiles once the acquisition has finished
+
+        :return: mosaic indexed by (channel, y, x), or None if the acquisition was incomplete
+        :rtype: np.ndarray
+        """
+
+        if self.mosaic is not None:
+            return self.mosaic
+        if self._accum is None or self._frames < self._expected:
+            if self._accum is not None:
+                logging.info(f'Streaming mosaic received {self._frames} of {self._expected} frames')
+            return None
+
+        mosaic = np.empty(self._accum.shape, dtype=self._dtype)
+        for chan in range(self._accum.shape[0]):
+            np.floor_divide(self._accum[chan], self._weights, out=self._accum[chan])
+            mosaic[chan] = self._accum[chan, :, ::-1]
+        self.mosaic = mosaic
+        self._accum = None
+        logging.info('Streaming mosaic finished')
+
+        return self.mosaic
+
+    def result(self, sequence: MDASequence):
+        """Get the streamed mosaic if it was acquired with the given sequence
+
+        :param sequence: current MDA sequence
+        :type sequence: MDASequence
+
+        :return: mosaic indexed by (channel, y, x), or None if it has to be stitched instead
+        :rtype: np.ndarray
+        """
+
+        if self.sequence is None:
+            return None
+        if sequence.grid_plan != self.sequence.grid_plan or sequence.channels != self.sequence.channels:
+            return None
+
+        return self.finish()
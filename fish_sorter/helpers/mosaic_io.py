@@ -0,0 +1,182 @@
+import concurrent.futures
+import logging
+import numpy as np
+import zarr
+
+from numcodecs import Blosc
+from ome_zarr.io import parse_url
+from ome_zarr.writer import write_multiscales_metadata
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# Chunk edge length in pixels, a well crop touches at most a handful of chunks
+MOSAIC_CHUNKS = (1024, 1024)
+MOSAIC_COMPRESSOR = Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+
+def write_mosaic(path, pyramid, pixel_size_um=None, chunks=MOSAIC_CHUNKS):
+    """Write a single channel mosaic pyramid as a chunked, compressed OME-Zarr
+
+    :param path: path of the .ome.zarr directory to create
+    :type path: str or Path
+    :param pyramid: pyramid levels (y, x), starting at full resolution, each half the previous size.
+        Levels are written one strip of chunks at a time, so a VirtualMosaic is never held in memory
+    :type pyramid: list of array-like
+    :param pixel_size_um: full resolution pixel size, stored as the scale of each level
+    :type pixel_size_um: float
+    :param chunks: chunk shape of every level
+    :type chunks: tuple
+    """
+
+    store = parse_url(str(path), mode='w').store
+    root = zarr.group(store=store, overwrite=True)
+    datasets = []
+    for level, image in enumerate(pyramid):
+        arr = root.create_dataset(
+            str(level), shape=image.shape, chunks=chunks, dtype=image.dtype, compressor=MOSAIC_COMPRESSOR,
+            dimension_separator='/',
+        )
+        write_level(arr, image)
+        scale = 1.0 if pixel_size_um is None else pixel_size_um
+        datasets.append({
+            'path': str(level),
+            'coordinateTransformations': [{'type': 'scale', 'scale': [scale * 2**level, scale * 2**level]}],
+        })
+    write_multiscales_metadata(root, datasets, axes='yx', name=Path(path).name.removesuffix('.ome.zarr'))
+    logging.info(f'Wrote {len(pyramid)} level mosaic to {path}')
+
+
+def write_level(arr, image):
+    """Copy an image into a zarr array one strip of chunk rows at a time
+
+    Each strip is read from the image only when it is written, so array-likes that compute
+    their pixels on demand are never loaded whole, and every chunk is written exactly once
+
+    :param arr: destination zarr array of the same shape
+    :type arr: zarr.Array
+    :param image: source image, any array-like that supports slicing
+    :type image: array-like
+    """
+
+    strip = arr.chunks[0]
+    for y in range(0, image.shape[0], strip):
+        arr[y : y + strip] = np.asarray(image[y : y + strip])
+
+
+def open_mosaic(path, level=0):
+    """Lazily open one level of a saved mosaic
+
+    Nothing is read until the array is sliced, and then only the chunks under the slice,
+    so single wells can be cropped without loading the whole mosaic
+
+    :param path: path of the .ome.zarr mosaic
+    :type path: str or Path
+    :param level: pyramid level, 0 is full resolution
+    :type level: int
+
+    :return: read-only array of the level
+    :rtype: zarr.Array
+    """
+
+    root = zarr.open_group(str(path), mode='r')
+    datasets = root.attrs['multiscales'][0]['datasets']
+
+    return root[datasets[level]['path']]
+
+
+def mosaic_levels(path):
+    """Lazily open every level of a saved mosaic, e.g. to add as a multiscale napari layer
+
+    :param path: path of the .ome.zarr mosaic
+    :type path: str or Path
+
+    :return: read-only arrays, starting at full resolution
+    :rtype: list of zarr.Array
+    """
+
+    root = zarr.open_group(str(path), mode='r')
+    datasets = root.attrs['multiscales'][0]['datasets']
+
+    return [root[dataset['path']] for dataset in datasets]
+
+
+def read_region(path, bounds, level=0):
+    """Read a rectangular region, e.g. a well crop, from a saved mosaic
+
+    :param path: path of the .ome.zarr mosaic
+    :type path: str or Path
+    :param bounds: full resolution pixel bounds as x1 y1 x2 y2, as given by Mapping.calc_crops
+    :type bounds: array-like
+    :param level: pyramid level to read from, bounds are scaled down to it
+    :type level: int
+
+    :return: region of the mosaic
+    :rtype: np.ndarray
+    """
+
+    x1, y1, x2, y2 = (np.asarray(bounds) // 2**level).astype(int)
+    arr = open_mosaic(path, level)
+
+    return arr[max(y1, 0) : max(y2, 0), max(x1, 0) : max(x2, 0)]
+
+
+class MosaicWriter:
+    """Writes mosaics to disk in a background thread so the GUI is not blocked
+    """
+
+    def __init__(self, max_workers: int=1):
+        """
+        :param max_workers: number of mosaics written concurrently
+        :type max_workers: int
+        """
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mosaic_writer')
+        self.futures = []
+
+    def submit(self, path, pyramid, pixel_size_um=None) -> concurrent.futures.Future:
+        """Queue a mosaic pyramid to be written
+
+        The pyramid arrays must not be modified until the returned future is done
+
+        :param path: path of the .ome.zarr directory to create
+        :type path: str or Path
+        :param pyramid: pyramid levels, starting at full resolution, e.g. VirtualMosaic levels
+        :type pyramid: list of array-like
+        :param pixel_size_um: full resolution pixel size
+        :type pixel_size_um: float
+
+        :return: future of the write
+        :rtype: concurrent.futures.Future
+        """
+
+        future = self.executor.submit(write_mosaic, path, pyramid, pixel_size_um)
+        future.add_done_callback(lambda f, p=path: self._write_done(f, p))
+        self.futures = [f for f in self.futures if not f.done()] + [future]
+
+        return future
+
+    def _write_done(self, future, path):
+        """Log failed writes from the background thread"""
+
+        if future.cancelled():
+            logging.warning(f'Mosaic write to {path} was cancelled')
+        elif future.exception() is not None:
+            logging.error(f'Failed to write mosaic to {path}: {future.exception()}')
+
+    def wait(self):
+        """Block until all queued mosaics are written"""
+
+        concurrent.futures.wait(self.futures)
+        self.futures = []
+
+    def shutdown(self, wait: bool=True):
+        """Stop the writer thread
+
+        :param wait: block until the queued writes are finished, otherwise they are abandoned
+        :type wait: bool
+        """
+
+        if wait and self.futures:
+            logging.info(f'Waiting for {len([f for f in self.futures if not f.done()])} mosaic writes to finish')
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,124 @@
+import bisect
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class NavigationIndex:
+    """Sorted well indices visited by well navigation
+
+    Kept up to date as single wells are added or removed, so moving to the next or previous
+    well and finding the position of a well are binary searches instead of scanning the plate
+    """
+
+    def __init__(self, wells=()):
+        """
+        :param wells: well indices in the index
+        :type wells: iterable of int
+        """
+
+        self._wells = sorted({int(well) for well in wells})
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Index of the wells where mask is True
+
+        :param mask: one value per well
+        :type mask: array-like of bool
+
+        :return: navigation index
+        :rtype: NavigationIndex
+        """
+
+        index = cls()
+        index._wells = np.flatnonzero(np.asarray(mask, dtype=bool)).tolist()
+
+        return index
+
+    def __len__(self):
+        return len(self._wells)
+
+    def __iter__(self):
+        return iter(self._wells)
+
+    def __contains__(self, well):
+        return self.position(well) >= 0
+
+    def add(self, well: int):
+        pos = bisect.bisect_left(self._wells, int(well))
+        if pos == len(self._wells) or self._wells[pos] != well:
+            self._wells.insert(pos, int(well))
+
+    def discard(self, well: int):
+        pos = self.position(well)
+        if pos >= 0:
+            del self._wells[pos]
+
+    def update(self, wells, values):
+        """Add or remove wells after their navigated feature changed
+
+        :param wells: well indices
+        :type wells: iterable of int
+        :param values: whether each well is navigated
+        :type values: iterable of bool
+        """
+
+        for well, value in zip(wells, values):
+            if value:
+                self.add(well)
+            else:
+                self.discard(well)
+
+    def position(self, well: int) -> int:
+        """Position of a well in navigation order
+
+        :param well: well index
+        :type well: int
+
+        :return: 0 based position, -1 if the well is not in the index
+        :rtype: int
+        """
+
+        pos = bisect.bisect_left(self._wells, int(well))
+        if pos < len(self._wells) and self._wells[pos] == well:
+            return pos
+        return -1
+
+    def next(self, well: int):
+        """First well after a well, wrapping around to the first well
+
+        :param well: well index, does not need to be in the index
+        :type well: int
+
+        :return: well index, None if the index is empty
+        :rtype: int
+        """
+
+        if not self._wells:
+            return None
+        pos = bisect.bisect_right(self._wells, int(well))
+
+        return self._wells[pos % len(self._wells)]
+
+    def previous(self, well: int):
+        """Last well before a well, wrapping around to the last well
+
+        :param well: well index, does not need to be in the index
+        :type well: int
+
+        :return: well index, None if the index is empty
+        :rtype: int
+        """
+
+        if not self._wells:
+            return None
+        pos = bisect.bisect_left(self._wells, int(well))
+
+        return self._wells[pos - 1]
+
+    def first(self):
+        return self._wells[0] if self._wells else None
+
+    def last(self):
+        return self._wells[-1] if self._wells else None
@@ -0,0 +1,222 @@
+import concurrent.futures
+import hashlib
+import logging
+import numpy as np
+
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+def phase_correlation(ref, mov):
+    """Subpixel translation between two equally sized images by FFT phase correlation
+
+    :param ref: reference image
+    :type ref: np.ndarray
+    :param mov: moving image
+    :type mov: np.ndarray
+
+    :return: (dy, dx) shift such that ref(y, x) matches mov(y - dy, x - dx), and the
+        correlation peak height in [0, 1] as a confidence
+    :rtype: np.ndarray, float
+    """
+
+    ref = ref.astype(np.float32)
+    mov = mov.astype(np.float32)
+    window = np.outer(np.hanning(ref.shape[0]), np.hanning(ref.shape[1])).astype(np.float32)
+    ref = (ref - ref.mean()) * window
+    mov = (mov - mov.mean()) * window
+
+    cross_power = np.fft.rfft2(ref) * np.conj(np.fft.rfft2(mov))
+    cross_power /= np.maximum(np.abs(cross_power), np.finfo(np.float32).eps)
+    corr = np.fft.irfft2(cross_power, s=ref.shape)
+
+    peak = np.array(np.unravel_index(np.argmax(corr), corr.shape))
+    shape = np.array(corr.shape)
+
+    # Parabolic fit through the peak and its wrapped neighbours on each axis
+    subpixel = np.zeros(2)
+    for axis in range(2):
+        before = peak.copy()
+        after = peak.copy()
+        before[axis] = (peak[axis] - 1) % shape[axis]
+        after[axis] = (peak[axis] + 1) % shape[axis]
+        c_before, c_peak, c_after = corr[tuple(before)], corr[tuple(peak)], corr[tuple(after)]
+        denom = c_before - 2 * c_peak + c_after
+        if denom != 0:
+            subpixel[axis] = 0.5 * (c_before - c_after) / denom
+
+    shift = peak + subpixel
+    shift = np.where(shift > shape / 2, shift - shape, shift)
+
+    return shift, float(corr[tuple(peak)])
+
+
+def registration_key(grid_list, overlap, tile_shape, samples=()):
+    """Cache key identifying a grid geometry and the tiles acquired on it
+
+    :param grid_list: grid index array from Mosaic.get_grid_list
+    :type grid_list: np.ndarray
+    :param overlap: grid overlap in percent as (x, y)
+    :type overlap: tuple
+    :param tile_shape: tile (y, x) shape in pixels
+    :type tile_shape: tuple
+    :param samples: subsampled tile images, so another plate imaged on the same grid gets its own key
+    :type samples: iterable of np.ndarray
+
+    :return: hex digest of the geometry and samples
+    :rtype: str
+    """
+
+    digest = hashlib.sha1(np.ascontiguousarray(grid_list, dtype=np.int64).tobytes())
+    digest.update(np.asarray(overlap, dtype=np.float64).tobytes())
+    digest.update(np.asarray(tile_shape, dtype=np.int64).tobytes())
+    for sample in samples:
+        digest.update(np.ascontiguousarray(sample).tobytes())
+
+    return digest.hexdigest()
+
+
+class TileRegistration:
+    """Refines nominal tile positions from the image content of the overlaps
+
+    Pairwise offsets of neighbouring tiles are estimated by phase correlation over their
+    overlap strips in a thread pool, then a global placement is solved by least squares.
+    Solved placements are cached in memory and on disk per grid geometry.
+    """
+
+    def __init__(self, cache_dir=None, max_workers=None, min_peak=0.05, max_shift=0.5):
+        """
+        :param cache_dir: directory for the on disk cache of solved placements, usually inside the
+            experiment directory. None to only cache in memory
+        :type cache_dir: Path
+        :param max_workers: number of threads correlating tile pairs, None for the executor default
+        :type max_workers: int
+        :param min_peak: correlation peak below which a pair falls back to its nominal offset
+        :type min_peak: float
+        :param max_shift: largest accepted correction as a fraction of the overlap width
+        :type max_shift: float
+        """
+
+        self._cache = {}
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.min_peak = min_peak
+        self.max_shift = max_shift
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, cache_dir):
+        # Placements cached in memory belong to the previous experiment
+        self._cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._cache = {}
+
+    def _load(self, key):
+        """Get a cached placement from memory or disk"""
+
+        if key in self._cache:
+            return self._cache[key]
+        if self.cache_dir is not None:
+            cache_file = self.cache_dir / f'{key}.npz'
+            if cache_file.exists():
+                with np.load(cache_file) as cached:
+                    self._cache[key] = (cached['y_starts'], cached['x_starts'])
+                return self._cache[key]
+        return None
+
+    def _save(self, key, y_starts, x_starts):
+        """Cache a solved placement in memory and on disk"""
+
+        self._cache[key] = (y_starts, x_starts)
+        if self.cache_dir is not None:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                np.savez(self.cache_dir / f'{key}.npz', y_starts=y_starts, x_starts=x_starts)
+            except OSError as e:
+                logging.warning(f'Could not write registration cache: {e}')
+
+    def register(self, get_tile, y_starts, x_starts, tile_shape, key=None):
+        """Solve the tile placement of a grid
+
+        :param get_tile: returns the 2D image of the tile at (row, col) of the unflipped mosaic
+        :type get_tile: Callable[[int, int], np.ndarray]
+        :param y_starts: nominal top pixel of each tile, shaped (num_rows, num_cols)
+        :type y_starts: np.ndarray
+        :param x_starts: nominal left pixel of each tile, shaped (num_rows, num_cols)
+        :type x_starts: np.ndarray
+        :param tile_shape: tile (y, x) shape in pixels
+        :type tile_shape: tuple
+        :param key: cache key of the grid geometry, None to skip the cache
+        :type key: str
+
+        :return: registered y and x starts, shifted so the mosaic starts at 0
+        :rtype: np.ndarray, np.ndarray
+        """
+
+        if key is not None:
+            cached = self._load(key)
+            if cached is not None and cached[0].shape == y_starts.shape:
+                logging.info(f'Using cached tile registration {key}')
+                return cached
+
+        num_rows, num_cols = y_starts.shape
+        tile_h, tile_w = tile_shape
+        pairs = [((row, col), (row, col + 1)) for row in range(num_rows) for col in range(num_cols - 1)]
+        pairs += [((row, col), (row + 1, col)) for row in range(num_rows - 1) for col in range(num_cols)]
+
+        def _pair_offset(pair):
+            """Measured offset of the second tile relative to the first"""
+
+            (row_a, col_a), (row_b, col_b) = pair
+            nominal = np.array([
+                y_starts[row_b, col_b] - y_starts[row_a, col_a],
+                x_starts[row_b, col_b] - x_starts[row_a, col_a],
+            ], dtype=float)
+            overlap_h = tile_h - int(nominal[0])
+            overlap_w = tile_w - int(nominal[1])
+            if overlap_h <= 0 or overlap_w <= 0:
+                return nominal, 0.0
+
+            strip_a = get_tile(row_a, col_a)[tile_h - overlap_h :, tile_w - overlap_w :]
+            strip_b = get_tile(row_b, col_b)[:overlap_h, :overlap_w]
+            shift, peak = phase_correlation(strip_a, strip_b)
+
+            limit = self.max_shift * min(overlap_h, overlap_w)
+            if peak < self.min_peak or np.any(np.abs(shift) > limit):
+                return nominal, 0.0
+
+            return nominal + shift, peak
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            offsets = list(pool.map(_pair_offset, pairs))
+
+        # Least squares over p_b - p_a = offset, anchored at the first tile
+        num_tiles = num_rows * num_cols
+        design = np.zeros((len(pairs) + 1, num_tiles))
+        targets = np.zeros((len(pairs) + 1, 2))
+        weights = np.ones(len(pairs) + 1)
+        for i, (((row_a, col_a), (row_b, col_b)), (offset, peak)) in enumerate(zip(pairs, offsets)):
+            design[i, row_a * num_cols + col_a] = -1
+            design[i, row_b * num_cols + col_b] = 1
+            targets[i] = offset
+            # Pairs without a usable correlation still hold the grid together, weakly
+            weights[i] = peak if peak > 0 else 1e-3
+        design[-1, 0] = 1
+        targets[-1] = [y_starts[0, 0], x_starts[0, 0]]
+        weights[-1] = 1e3
+
+        positions, *_ = np.linalg.lstsq(design * weights[:, None], targets * weights[:, None], rcond=None)
+        positions = np.round(positions - positions.min(axis=0)).astype(int)
+        reg_y_starts = positions[:, 0].reshape(num_rows, num_cols)
+        reg_x_starts = positions[:, 1].reshape(num_rows, num_cols)
+
+        accepted = sum(peak > 0 for _, peak in offsets)
+        logging.info(f'Registered {accepted} of {len(pairs)} tile pairs by phase correlation')
+
+        if key is not None:
+            self._save(key, reg_y_starts, reg_x_starts)
+
+        return reg_y_starts, reg_x_starts
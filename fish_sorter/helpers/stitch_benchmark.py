@@ -0,0 +1,299 @@
+import argparse
+import json
+import logging
+import numpy as np
+import sys
+import tracemalloc
+import types
+
+from pathlib import Path
+from time import perf_counter
+from useq import MDASequence
+
+from fish_sorter.constants import CAM_PX_UM, CAM_X_PX, CAM_Y_PX
+from fish_sorter.helpers.mosaic import Mosaic, plan_grid_index
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the process peak is not reported there
+    resource = None
+
+log = logging.getLogger(__name__)
+
+
+class SyntheticTiles:
+    """Zarr-like (p, g, c, y, x) stack of synthetic tiles, generated on access
+
+    Every tile is a vignetted noise pattern per channel plus a position dependent
+    offset, so tile stacks of any grid size can be benchmarked without holding them in memory
+    """
+
+    def __init__(self, num_positions, num_channels, tile_shape=(CAM_Y_PX, CAM_X_PX), seed=0):
+        """
+        :param num_positions: number of grid positions
+        :type num_positions: int
+        :param num_channels: number of channels
+        :type num_channels: int
+        :param tile_shape: (y, x) shape of each tile
+        :type tile_shape: tuple
+        :param seed: random seed of the tile pattern
+        :type seed: int
+        """
+
+        rng = np.random.default_rng(seed)
+        yy, xx = np.mgrid[0 : tile_shape[0], 0 : tile_shape[1]]
+        radius = ((yy - tile_shape[0] / 2) / tile_shape[0])**2 + ((xx - tile_shape[1] / 2) / tile_shape[1])**2
+        vignette = 1 - radius
+        self.base = np.stack([
+            (vignette * rng.normal(2000, 300, tile_shape)).clip(0, 60000).astype(np.uint16)
+            for _ in range(num_channels)
+        ])
+        self.offsets = rng.integers(0, 2000, size=num_positions).astype(np.uint16)
+        self.shape = (1, num_positions, num_channels, *tile_shape)
+        self.dtype = np.dtype(np.uint16)
+        self.ndim = 5
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        g, c, yx = key[1], key[2], key[3:]
+        tiles = self.base[c][(Ellipsis, *yx)] + self.offsets[g]
+
+        return tiles
+
+
+def make_sequence(rows, cols, num_channels, overlap=5.0, pixel_size_um=CAM_PX_UM / 4):
+    """Build an MDA sequence with a GridFromEdges plan of rows x cols tiles
+
+    :param rows: number of grid rows
+    :type rows: int
+    :param cols: number of grid columns
+    :type cols: int
+    :param num_channels: number of channels
+    :type num_channels: int
+    :param overlap: tile overlap in percent
+    :type overlap: float
+    :param pixel_size_um: image pixel size in um
+    :type pixel_size_um: float
+
+    :return: sequence of the grid
+    :rtype: MDASequence
+    """
+
+    fov_w = CAM_X_PX * pixel_size_um
+    fov_h = CAM_Y_PX * pixel_size_um
+    dx = fov_w * (1 - overlap / 100)
+    dy = fov_h * (1 - overlap / 100)
+    channels = ['GFP', 'TXR', 'CY5', 'DAPI', 'CIT', 'BF']
+
+    # Shrink the extent slightly so float rounding does not add a row or column
+    return MDASequence(
+        grid_plan={
+            'top': 0.0,
+            'left': 0.0,
+            'bottom': (rows - 1) * dy * 0.999,
+            'right': (cols - 1) * dx * 0.999,
+            'overlap': (overlap, overlap),
+            'fov_width': fov_w,
+            'fov_height': fov_h,
+        },
+        channels=[{'config': channels[i % len(channels)], 'exposure': 300} for i in range(num_channels)],
+        axis_order='gc',
+    )
+
+
+def grid_for_array(array_file, pixel_size_um, overlap=5.0):
+    """Number of grid rows and columns needed to image an array config
+
+    :param array_file: path to an array config in configs/arrays
+    :type array_file: Path
+    :param pixel_size_um: image pixel size in um
+    :type pixel_size_um: float
+    :param overlap: tile overlap in percent
+    :type overlap: float
+
+    :return: rows, cols
+    :rtype: int, int
+    """
+
+    with open(array_file) as f:
+        design = json.load(f)['array_design']
+    width = (design['columns'] - 1) * (design['column_spacing'] + design['slot_length']) + design['slot_length']
+    height = (design['rows'] - 1) * (design['row_spacing'] + design['slot_width']) + design['slot_width']
+    dx = CAM_X_PX * pixel_size_um * (1 - overlap / 100)
+    dy = CAM_Y_PX * pixel_size_um * (1 - overlap / 100)
+
+    return int(np.ceil(height / dy)) + 1, int(np.ceil(width / dx)) + 1
+
+
+def _max_rss_mb():
+    """Peak resident memory of the process so far, None where unsupported
+
+    This is a high-water mark over the whole process lifetime that never goes down, so it
+    cannot be attributed to a single stage
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KB on Linux
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def run_stage(name, func, nbytes):
+    """Time a single benchmark stage and measure the peak of the memory it allocates with tracemalloc
+
+    :param name: stage name
+    :type name: str
+    :param func: stage to run
+    :type func: Callable
+    :param nbytes: bytes of tile data the stage processes, for throughput
+    :type nbytes: int
+
+    :return: stage result and its stats
+    :rtype: Any, dict
+    """
+
+    tracemalloc.start()
+    start = perf_counter()
+    result = func()
+    elapsed = perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = {
+        'stage': name,
+        'time_s': elapsed,
+        'traced_peak_mb': traced_peak / 2**20,
+        'mb_per_s': (nbytes / 2**20) / elapsed if elapsed > 0 and nbytes else None,
+    }
+
+    return result, stats
+
+
+def benchmark(rows, cols, num_channels, overlap=5.0, workers=2, register=False, lazy=False):
+    """Drive synthetic tiles through get_mosaic_metadata and stitch_mosaic headless
+
+    :param rows: number of grid rows
+    :type rows: int
+    :param cols: number of grid columns
+    :type cols: int
+    :param num_channels: number of channels
+    :type num_channels: int
+    :param overlap: tile overlap in percent
+    :type overlap: float
+    :param workers: stitching worker threads
+    :type workers: int
+    :param register: also benchmark phase correlation registration
+    :type register: bool
+    :param lazy: also benchmark the lazy virtual mosaic
+    :type lazy: bool
+
+    :return: stats of each stage
+    :rtype: list of dict
+    """
+
+    sequence = make_sequence(rows, cols, num_channels, overlap)
+    num_positions = sequence.grid_plan.num_positions()
+    tiles = SyntheticTiles(num_positions, num_channels)
+    viewer = types.SimpleNamespace(layers=[types.SimpleNamespace(data=tiles)])
+    mosaic = Mosaic(viewer)
+    mosaic.registration.cache_dir = None
+
+    results = []
+    plan_grid_index.cache_clear()
+    _, stats = run_stage('get_mosaic_metadata', lambda: mosaic.get_mosaic_metadata(sequence), 0)
+    results.append(stats)
+    _, stats = run_stage('get_mosaic_metadata (repeat)', lambda: mosaic.get_mosaic_metadata(sequence), 0)
+    results.append(stats)
+
+    stitched, stats = run_stage(
+        'stitch_mosaic',
+        lambda: mosaic.stitch_mosaic(sequence, None, register=False, correct=False, max_workers=workers),
+        tiles.nbytes,
+    )
+    results.append(stats)
+
+    _, stats = run_stage('build_pyramid', lambda: mosaic.build_pyramid(stitched[0]), stitched[0].nbytes)
+    results.append(stats)
+    del stitched
+
+    if register:
+        _, stats = run_stage(
+            'stitch_mosaic (registered)',
+            lambda: mosaic.stitch_mosaic(sequence, None, register=True, correct=False, max_workers=workers),
+            tiles.nbytes,
+        )
+        results.append(stats)
+
+    if lazy:
+        levels, stats = run_stage('virtual_mosaic', lambda: mosaic.virtual_mosaic(sequence, tiles, register=False, correct=False)[0], 0)
+        results.append(stats)
+        region = (slice(0, CAM_Y_PX), slice(0, CAM_X_PX))
+        _, stats = run_stage('virtual_mosaic tile region', lambda: levels[0][region], CAM_Y_PX * CAM_X_PX * 2)
+        results.append(stats)
+        _, stats = run_stage('virtual_mosaic coarsest level', lambda: np.asarray(levels[-1]), 0)
+        results.append(stats)
+
+    return results
+
+
+def report(results, rows, cols, num_channels):
+    """Print a table of the benchmark stats"""
+
+    print(f'Grid {rows} x {cols} tiles of {CAM_Y_PX} x {CAM_X_PX} px, {num_channels} channels')
+    print(f'{"stage":<32}{"time [s]":>10}{"traced peak [MB]":>18}{"MB/s":>10}')
+    for stats in results:
+        rate = f'{stats["mb_per_s"]:.0f}' if stats['mb_per_s'] is not None else '-'
+        print(f'{stats["stage"]:<32}{stats["time_s"]:>10.3f}{stats["traced_peak_mb"]:>18.0f}{rate:>10}')
+    rss = _max_rss_mb()
+    if rss is not None:
+        print(f'Process peak RSS over all stages: {rss:.0f} MB')
+
+
+def main() -> bool:
+    """
+    Benchmark mosaic stitching on synthetic tiles
+
+    :return: A bool as to whether the benchmark ran successfully through all stages.
+    :rtype: bool
+    """
+
+    parser = argparse.ArgumentParser(prog='stitch_benchmark', description='Benchmark mosaic stitching on synthetic tiles')
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--cols', type=int, default=16)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--overlap', type=float, default=5.0, help='tile overlap in percent')
+    parser.add_argument('--workers', type=int, default=2, help='stitching worker threads')
+    parser.add_argument('--array', type=str, default=None, help='array config in configs/arrays to size the grid from')
+    parser.add_argument('--mag', type=float, default=4.0, help='objective magnification, used with --array')
+    parser.add_argument('--register', action='store_true', help='also benchmark tile registration')
+    parser.add_argument('--lazy', action='store_true', help='also benchmark the lazy virtual mosaic')
+    args = parser.parse_args()
+
+    rows, cols = args.rows, args.cols
+    if args.array is not None:
+        array_file = Path(__file__).absolute().parent.parent / 'configs/arrays' / args.array
+        rows, cols = grid_for_array(array_file, CAM_PX_UM / args.mag, args.overlap)
+
+    try:
+        results = benchmark(rows, cols, args.channels, args.overlap, args.workers, args.register, args.lazy)
+    except Exception as e:
+        print(e)
+        return False
+    report(results, rows, cols, args.channels)
+
+    return True
+
+
+if __name__ == "__main__":
+    proceed = main()
+
+    if not proceed:
+        print("Exited with error(s)")
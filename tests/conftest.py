@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from fish_sorter.helpers.mapping import Mapping
+
+ARRAY_FILE = Path(__file__).parents[1] / 'fish_sorter' / 'configs' / 'arrays' / '400circular_array20240822.json'
+
+
+class Plate(Mapping):
+
+    def set_calib_pts(self, pipettor_cfg=None):
+        self.um_TL = np.array([1000.0, 2000.0])
+        self.um_BR = np.array([50000.0, 30000.0])
+
+    def go_to_well(self, well, offset):
+        pass
+
+
+@pytest.fixture
+def plate():
+    plate = Plate(ARRAY_FILE, 2.0)
+    plate.set_calib_pts()
+
+    return plate
@@ -0,0 +1,39 @@
+import numpy as np
+
+from fish_sorter.helpers.calibration_store import CalibrationStore
+from fish_sorter.helpers.stitch_benchmark import make_sequence
+
+
+def test_saved_calibration_restores_the_plate(plate, tmp_path):
+    plate.load_wells()
+    plate.add_fiducial(plate.well_names[0], plate.get_abs_um_from_well_name(plate.well_names[0]) + [4.0, -2.0])
+    plate.load_wells()
+    grid_plan = make_sequence(2, 2, 1).grid_plan
+    key = CalibrationStore.key(plate.array_file, '4x', grid_plan)
+    CalibrationStore(tmp_path).put(key, plate.calibration_state())
+
+    # A new store only has the calibration on disk
+    state = CalibrationStore(tmp_path).get(key)
+    restored = type(plate)(plate.array_file, plate.px_sz_um)
+    restored.restore_calibration(state)
+
+    names = list(plate.well_names)
+    np.testing.assert_allclose(restored.get_positions(names), plate.get_positions(names))
+    np.testing.assert_allclose(restored.transform_exp2actual, plate.transform_exp2actual)
+    assert list(restored.fiducials) == list(plate.fiducials)
+    np.testing.assert_allclose(restored.transform([[10.0, 20.0]], 'px', 'stage'), plate.transform([[10.0, 20.0]], 'px', 'stage'))
+
+
+def test_key_and_memory_cache(plate):
+    grid_plan = make_sequence(2, 2, 1).grid_plan
+    key = CalibrationStore.key(plate.array_file, '4x', grid_plan)
+    assert key == CalibrationStore.key(plate.array_file, '4x', grid_plan)
+    assert key != CalibrationStore.key(plate.array_file, '10x', grid_plan)
+    assert key != CalibrationStore.key(plate.array_file, '4x', make_sequence(2, 3, 1).grid_plan)
+
+    store = CalibrationStore(maxsize=1)
+    store.put('a', {'um_TL': np.zeros(2)})
+    store.put('b', {'um_TL': np.ones(2)})
+
+    assert store.get('a') is None
+    np.testing.assert_array_equal(store.get('b')['um_TL'], np.ones(2))
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pandas")
+
+from fish_sorter.helpers.classifier import WellClassifier, load_training_data
+
+
+def _plate(n=200, seed=0):
+    # Singlets have a large area, red singlets a high mean
+    rng = np.random.default_rng(seed)
+    singlet = rng.random(n) < 0.5
+    red = singlet & (rng.random(n) < 0.5)
+    table = np.zeros(n, dtype=[('sum_area', 'f4'), ('sum_mean', 'f4')])
+    table['sum_area'] = singlet + rng.normal(0, 0.1, n)
+    table['sum_mean'] = 2 * red + rng.normal(0, 0.3, n)
+    Y = np.stack([~singlet, singlet, red], axis=1)
+
+    return table, Y
+
+
+def test_fit_and_predict_separable_plate():
+    table, Y = _plate()
+    X = np.stack([table['sum_area'], table['sum_mean']], axis=1).astype(float)
+    classifier = WellClassifier(['empty', 'singlet'], ['red'])
+
+    assert classifier.fit(X, Y, ['sum_area', 'sum_mean'])
+    predictions, confidence = classifier.predict(table)
+
+    np.testing.assert_array_equal(predictions['singlet'], Y[:, 1])
+    assert (predictions['red'] == Y[:, 2]).mean() > 0.95
+    assert not np.any(predictions['red'] & ~predictions['singlet'])
+    assert confidence.shape == (len(table),)
+    assert np.all((confidence >= 0) & (confidence <= 1))
+
+
+def test_too_few_classified_wells_do_not_train():
+    table, Y = _plate(n=20)
+    X = np.stack([table['sum_area'], table['sum_mean']], axis=1).astype(float)
+    classifier = WellClassifier(['empty', 'singlet'], ['red'], min_samples=50)
+
+    assert not classifier.fit(X, Y, ['sum_area', 'sum_mean'])
+    assert not classifier.trained
+
+
+def test_single_class_label_is_predicted_constant():
+    table, Y = _plate()
+    Y[:, 2] = False
+    X = np.stack([table['sum_area'], table['sum_mean']], axis=1).astype(float)
+    classifier = WellClassifier(['empty', 'singlet'], ['red'])
+    classifier.fit(X, Y, ['sum_area', 'sum_mean'])
+
+    predictions, _ = classifier.predict(table)
+
+    assert not predictions['red'].any()
+
+
+def test_training_data_is_joined_by_well_name(tmp_path):
+    import pandas as pd
+
+    well_names = ['A01', 'A02', 'A03', 'A04']
+    table = np.zeros(4, dtype=[('sum_area', 'f4'), ('sum_mean', 'f4')])
+    table['sum_area'] = [0, 1, 2, 3]
+    np.save(tmp_path / 'run_features.npy', table)
+    # Saved out of plate order, with a well that is not on the plate
+    pd.DataFrame({
+        'slotName': ['A03', 'A01', 'B01'],
+        'singlet': [1, 0, 1],
+    }).to_csv(tmp_path / 'run_classifications.csv', index=False)
+
+    X, Y, names = load_training_data(
+        [(tmp_path / 'run_classifications.csv', tmp_path / 'run_features.npy')], ['singlet', 'red'], well_names
+    )
+
+    assert names == ['sum_area', 'sum_mean']
+    np.testing.assert_array_equal(X[:, 0], [2, 0])
+    np.testing.assert_array_equal(Y, [[True, False], [False, False]])
+
+
+def test_no_prediction_without_trained_features():
+    table, Y = _plate()
+    X = np.stack([table['sum_area'], table['sum_mean']], axis=1).astype(float)
+    classifier = WellClassifier(['empty', 'singlet'], ['red'])
+    classifier.fit(X, Y, ['sum_area', 'sum_mean'])
+
+    assert classifier.predict(table[['sum_area']]) is None
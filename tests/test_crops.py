@@ -0,0 +1,70 @@
+import numpy as np
+
+from fish_sorter.helpers.crops import crop_wells
+
+
+class SliceOnly:
+    """Array-like that only supports slicing, like the lazy mosaic"""
+
+    def __init__(self, image):
+        self.image = image
+        self.shape = image.shape
+        self.dtype = image.dtype
+
+    def __getitem__(self, key):
+        return self.image[key]
+
+
+def test_inside_crops_match_slices():
+    image = np.arange(40 * 60, dtype=np.uint16).reshape(40, 60)
+    centers = np.array([[10, 10], [20, 30], [30, 50]])
+
+    crops = crop_wells(image, centers, (6, 8))
+
+    assert crops.shape == (3, 6, 8)
+    for crop, (y, x) in zip(crops, centers):
+        np.testing.assert_array_equal(crop, image[y - 3 : y + 3, x - 4 : x + 4])
+
+
+def test_border_crops_are_zero_padded():
+    image = np.ones((40, 60), dtype=np.uint16)
+    centers = np.array([[1, 2], [39, 58]])
+
+    crops = crop_wells(image, centers, (6, 8))
+
+    # Top left well starts at (-2, -2), bottom right ends at (42, 62)
+    np.testing.assert_array_equal(crops[0, :2], 0)
+    np.testing.assert_array_equal(crops[0, :, :2], 0)
+    np.testing.assert_array_equal(crops[0, 2:, 2:], 1)
+    np.testing.assert_array_equal(crops[1, -2:], 0)
+    np.testing.assert_array_equal(crops[1, :, -2:], 0)
+    np.testing.assert_array_equal(crops[1, :-2, :-2], 1)
+
+
+def test_wells_outside_the_image_are_empty():
+    image = np.ones((40, 60), dtype=np.uint16)
+
+    crops = crop_wells(image, np.array([[100, 100]]), (6, 8))
+
+    np.testing.assert_array_equal(crops, 0)
+
+
+def test_slice_only_images_match_arrays():
+    image = np.random.default_rng(0).integers(0, 1000, (40, 60), dtype=np.uint16)
+    centers = np.array([[1, 2], [20, 30], [39, 58]])
+
+    np.testing.assert_array_equal(
+        crop_wells(SliceOnly(image), centers, (6, 8)),
+        crop_wells(image, centers, (6, 8)),
+    )
+
+
+def test_subset_of_wells_fills_preallocated_stack():
+    image = np.ones((40, 60), dtype=np.uint16)
+    centers = np.array([[10, 10], [20, 30], [30, 50]])
+    out = np.full((3, 6, 8), 7, dtype=np.uint16)
+
+    crop_wells(image, centers, (6, 8), out=out, wells=[1])
+
+    np.testing.assert_array_equal(out[1], 1)
+    np.testing.assert_array_equal(out[[0, 2]], 7)
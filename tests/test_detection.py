@@ -0,0 +1,106 @@
+import numpy as np
+
+from skimage import draw
+
+from fish_sorter.helpers.detection import count_objects, fish_orientation, well_features
+
+
+CENTERS = np.array([[40, 40], [40, 120], [40, 200], [40, 280]])
+
+
+def _wells(blobs):
+    """Image of wells in a row with the given blobs, each (well, dy, dx, radius) around the well center"""
+
+    image = np.full((80, 320), 100, dtype=np.uint16)
+    for well, dy, dx, radius in blobs:
+        y, x = CENTERS[well]
+        rr, cc = draw.disk((y + dy, x + dx), radius, shape=image.shape)
+        image[rr, cc] = 1000
+
+    return image
+
+
+def test_count_objects_per_well():
+    mask = np.zeros((60, 60), dtype=bool)
+    rr, cc = draw.disk((30, 30), 28)
+    mask[rr, cc] = True
+    image = _wells([(1, 0, 0, 6), (2, -12, -12, 5), (2, 12, 12, 5), (3, 0, 0, 5), (3, 20, 0, 0.6)])
+
+    counts, objects = count_objects([image], CENTERS, mask, sigma=1, chunk=3, max_workers=2)
+
+    # The single pixel in the last well is below the minimum area
+    np.testing.assert_array_equal(counts, [0, 1, 2, 1])
+    assert [len(well) for well in objects] == [0, 1, 2, 1]
+    area, (y1, x1, y2, x2) = objects[1][0]
+    assert area == np.count_nonzero(image[:, 80:160] == 1000)
+    # Radius 6 disk around the crop center at (30, 30)
+    assert (y1, x1, y2, x2) == (25, 25, 36, 36)
+
+
+def test_count_objects_sums_the_images():
+    mask = np.ones((60, 60), dtype=bool)
+    image = _wells([(0, 0, 0, 6)])
+    other = _wells([(0, 0, -15, 4), (1, 0, 0, 6)])
+
+    counts, _ = count_objects([image, other], CENTERS, mask, sigma=1)
+
+    np.testing.assert_array_equal(counts, [2, 1, 0, 0])
+
+
+def _fish(shape, head_left, angle):
+    """Crop of a fish, a bright head disk and a thinner tail, rotated counterclockwise by angle [rad]"""
+
+    yy, xx = np.mgrid[0 : shape[0], 0 : shape[1]] - np.array(shape)[:, None, None] // 2
+    # Along and across the body axis, y points down in the image
+    along = xx * np.cos(angle) - yy * np.sin(angle)
+    across = xx * np.sin(angle) + yy * np.cos(angle)
+    if not head_left:
+        along = -along
+    head = (along + 12)**2 + across**2 < 6**2
+    tail = (along > -12) & (along < 18) & (np.abs(across) < 2)
+
+    return np.where(head, 1000, np.where(tail, 600, 100)).astype(np.uint16)
+
+
+def test_fish_orientation_finds_the_head_side():
+    mask = np.ones((60, 60), dtype=bool)
+    wells = [(True, 0), (False, 0), (True, np.deg2rad(30)), (False, np.deg2rad(-40))]
+    image = np.full((60, 60 * len(wells)), 100, dtype=np.uint16)
+    for i, (head_left, angle) in enumerate(wells):
+        image[:, 60 * i : 60 * (i + 1)] = _fish(mask.shape, head_left, angle)
+    centers = np.array([[30, 60 * i + 30] for i in range(len(wells))])
+
+    table = well_features({'sum': [image]}, centers, mask, sigma=0.5)
+    fish = fish_orientation(table, 'sum')
+
+    np.testing.assert_array_equal(fish['lhead'], [head_left for head_left, _ in wells])
+    # The axis angle is only defined up to a half turn
+    np.testing.assert_allclose(np.cos(2 * (fish['angle'] - [angle for _, angle in wells])), 1, atol=1e-2)
+    # The head pulls the body center towards it
+    assert fish['cx'][0] < 0 < fish['cx'][1]
+
+
+def test_well_features_of_a_known_blob():
+    mask = np.ones((60, 60), dtype=bool)
+    image = np.zeros((60, 120), dtype=np.uint16)
+    # An ellipse twice as long as wide, 5 px right and 3 px below the center of the second well
+    rr, cc = draw.ellipse(33, 95, 5, 10, shape=image.shape)
+    image[rr, cc] = 200
+    centers = np.array([[30, 30], [30, 90]])
+
+    table = well_features({'a': [image], 'sum': [image, image]}, centers, mask, sigma=1, chunk=1)
+
+    blob = image[:, 60:]
+    np.testing.assert_allclose(table['a_area'], [0, len(rr) / mask.size])
+    np.testing.assert_allclose(table['a_mean'], [0, blob.mean()], rtol=1e-6)
+    np.testing.assert_allclose(table['a_std'], [0, blob.std()], rtol=1e-5)
+    np.testing.assert_allclose(table['sum_mean'], 2 * table['a_mean'], rtol=1e-6)
+    np.testing.assert_allclose(table['a_cy'][1], 3, atol=1e-3)
+    np.testing.assert_allclose(table['a_cx'][1], 5, atol=1e-3)
+    np.testing.assert_allclose(table['a_angle'][1], 0, atol=1e-3)
+    np.testing.assert_allclose(table['a_elongation'][1], np.sqrt(cc.var() / rr.var()), rtol=1e-3)
+    np.testing.assert_allclose(table['a_skew'][1], 0, atol=1e-3)
+    left = np.count_nonzero(cc - 60 < 30)
+    np.testing.assert_allclose(table['a_asymmetry'][1], (2 * left - len(cc)) / len(cc), rtol=1e-5)
+    # The empty well has no moments
+    assert table['a_elongation'][0] == 0
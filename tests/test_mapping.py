@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+
+def test_get_positions_matches_single_lookups(plate):
+    plate.load_wells()
+    names = [plate.well_names[0], 'not a well', plate.well_names[-1]]
+
+    pos = plate.get_positions(names, offset=np.array([10, -20]))
+
+    np.testing.assert_allclose(pos[0], plate.get_abs_um_from_well_name(names[0]) + [10, -20])
+    np.testing.assert_allclose(pos[2], plate.get_abs_um_from_well_name(names[2]) + [10, -20])
+    assert np.isnan(pos[1]).all()
+    np.testing.assert_array_equal(plate.get_well_ids(names), [0, -1, len(plate.well_names) - 1])
+
+
+def test_calc_affine_recovers_shear_and_scale(plate):
+    exp_rel_um = np.array([[0, 0], [10000, 0], [0, 8000], [10000, 8000], [5000, 4000]], dtype=float)
+    transform = np.array([[1.01, 0.02], [0.005, 0.98]])
+    translation = np.array([15.0, -7.0])
+    actual_abs_um = exp_rel_um @ transform + translation + plate.um_TL
+
+    residuals = plate.calc_affine(exp_rel_um, actual_abs_um, names=list('ABCDE'))
+
+    np.testing.assert_allclose(plate.transform_exp2actual, transform, atol=1e-9)
+    np.testing.assert_allclose(plate.translation_exp2actual, translation, atol=1e-6)
+    np.testing.assert_allclose(residuals, 0, atol=1e-6)
+    np.testing.assert_allclose(plate.transform(exp_rel_um, 'exp', 'stage'), actual_abs_um, atol=1e-6)
+    assert set(plate.calib_residuals_um) == set('ABCDE')
+
+
+def test_calc_affine_needs_three_wells_off_one_line(plate):
+    with pytest.raises(ValueError):
+        plate.calc_affine([[0, 0], [1, 0]], [[0, 0], [1, 0]])
+    with pytest.raises(ValueError):
+        plate.calc_affine([[0, 0], [1, 1], [2, 2]], [[0, 0], [1, 1], [2, 2]])
+
+
+def test_fiducials_fit_the_wells(plate):
+    plate.load_wells()
+    names = list(plate.well_names)
+    measured = {name: plate.get_abs_um_from_well_name(name) + [5.0, -3.0] for name in (names[0], names[150], names[-1])}
+    for name, pos in measured.items():
+        plate.add_fiducial(name, pos)
+
+    plate.load_wells()
+
+    np.testing.assert_allclose(plate.get_positions(list(measured)), list(measured.values()), atol=1e-6)
+
+
+def test_frames_follow_calibration_changes(plate):
+    plate.load_wells()
+    point = np.array([[1000.0, 500.0]])
+    before = plate.transform(point, 'exp', 'stage')
+
+    # Updated in place, as by a recalibration of the top left corner
+    plate.um_TL += [10.0, -5.0]
+
+    np.testing.assert_allclose(plate.transform(point, 'exp', 'stage'), before + [10.0, -5.0])
+    np.testing.assert_allclose(plate.transform(plate.transform(point, 'exp', 'px'), 'px', 'exp'), point)
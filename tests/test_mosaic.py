@@ -0,0 +1,149 @@
+import types
+
+import numpy as np
+import pytest
+
+from pymmcore_plus.mda import MDARunner
+from useq import MDASequence
+
+from fish_sorter.constants import CAM_X_PX, CAM_Y_PX, MIRROR_X
+from fish_sorter.helpers.mosaic import FlatField, Mosaic, StreamingMosaic, plan_grid_index
+from fish_sorter.helpers.stitch_benchmark import SyntheticTiles, make_sequence
+
+
+def brute_force_mosaic(sequence, tiles, chan):
+    """Average of every tile covering each mosaic pixel, placed by the stage position of its MDA events"""
+
+    positions = {event.index['g']: (event.x_pos, event.y_pos) for event in sequence.iter_events()}
+    xs = sorted({x for x, _ in positions.values()})
+    ys = sorted({y for _, y in positions.values()})
+    overlap = sequence.grid_plan.overlap
+    x_step = CAM_X_PX - int(CAM_X_PX * overlap[0] / 100)
+    y_step = CAM_Y_PX - int(CAM_Y_PX * overlap[1] / 100)
+
+    total = np.zeros(((len(ys) - 1) * y_step + CAM_Y_PX, (len(xs) - 1) * x_step + CAM_X_PX), dtype=np.uint32)
+    count = np.zeros(total.shape, dtype=np.uint32)
+    for g, (x, y) in positions.items():
+        y0 = ys.index(y) * y_step
+        x0 = xs.index(x) * x_step
+        tile = tiles[0, g, chan]
+        # The stitched mosaic is flipped in x, mirroring the tiles unless MIRROR_X flips them back
+        total[y0 : y0 + CAM_Y_PX, x0 : x0 + CAM_X_PX] += tile if MIRROR_X else tile[:, ::-1]
+        count[y0 : y0 + CAM_Y_PX, x0 : x0 + CAM_X_PX] += 1
+
+    return total // count
+
+
+@pytest.fixture
+def acquired():
+    # 2 rows x 3 columns of tiles in 2 channels, as the MDA tile array in the viewer
+    sequence = make_sequence(2, 3, 2)
+    tiles = SyntheticTiles(sequence.grid_plan.num_positions(), 2)
+    mosaic = Mosaic(types.SimpleNamespace(layers=[types.SimpleNamespace(data=tiles)]))
+    mosaic.flatfield = FlatField(cache_dir=None)
+
+    return sequence, tiles, mosaic
+
+
+@pytest.mark.parametrize('correct', [False, True])
+def test_virtual_mosaic_levels_match_stitched_pyramid(acquired, correct):
+    sequence, tiles, mosaic = acquired
+
+    stitched = mosaic.stitch_mosaic(sequence, None, register=False, correct=correct)
+    lazy = mosaic.virtual_mosaic(sequence, tiles, register=False, correct=correct, min_size=256)
+
+    assert len(lazy) == 2
+    for chan in range(2):
+        pyramid = mosaic.build_pyramid(stitched[chan], min_size=256)
+        assert len(lazy[chan]) == len(pyramid) > 1
+        for level, virtual in zip(pyramid, lazy[chan]):
+            np.testing.assert_array_equal(np.asarray(virtual), level)
+
+
+def test_stitch_mosaic_averages_the_overlaps(acquired):
+    sequence, tiles, mosaic = acquired
+
+    stitched = mosaic.stitch_mosaic(sequence, None, register=False, correct=False, max_workers=2)
+
+    assert stitched.shape[0] == 2
+    for chan in range(2):
+        np.testing.assert_array_equal(stitched[chan], brute_force_mosaic(sequence, tiles, chan))
+
+
+class TileEngine:
+    """MDA engine that acquires the synthetic tiles, so the runner emits the same events as on the instrument"""
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def setup_sequence(self, sequence):
+        return None
+
+    def setup_event(self, event):
+        pass
+
+    def exec_event(self, event):
+        yield self.tiles[0, event.index['g'], event.index['c']], event, {}
+
+    def event_iterator(self, events):
+        return iter(events)
+
+    def teardown_event(self, event):
+        pass
+
+    def teardown_sequence(self, sequence):
+        pass
+
+
+def test_streaming_mosaic_matches_stitched(acquired):
+    sequence, tiles, mosaic = acquired
+    runner = MDARunner()
+    runner.set_engine(TileEngine(tiles))
+    streaming = StreamingMosaic(types.SimpleNamespace(mda=runner))
+    streaming.connect()
+
+    runner.run(sequence)
+
+    streamed = streaming.result(sequence)
+    stitched = mosaic.stitch_mosaic(sequence, None, register=False, correct=False)
+    np.testing.assert_array_equal(streamed, stitched)
+    np.testing.assert_array_equal(streamed[1], brute_force_mosaic(sequence, tiles, 1))
+    assert streaming.result(make_sequence(2, 2, 2)) is None
+
+
+def test_incomplete_streaming_mosaic_is_not_used(acquired):
+    sequence, tiles, _ = acquired
+    streaming = StreamingMosaic(None)
+    streaming.start(sequence)
+    for event in list(sequence.iter_events())[:-1]:
+        streaming.add_frame(tiles[0, event.index['g'], event.index['c']], event)
+
+    assert streaming.result(sequence) is None
+
+
+def walked_grid_index(sequence):
+    """grid_list of the MDA events, each position's index and stage position at its rank in x and y"""
+
+    positions = {event.index['g']: (event.x_pos, event.y_pos) for event in sequence.iter_events()}
+    xs = sorted({x for x, _ in positions.values()})
+    ys = sorted({y for _, y in positions.values()})
+    grid_list = np.zeros((len(xs), len(ys), 3), dtype=int)
+    for g, (x, y) in positions.items():
+        grid_list[xs.index(x), ys.index(y)] = (g, x, y)
+
+    return grid_list, len(ys), len(xs)
+
+
+@pytest.mark.parametrize('mode', ['row_wise_snake', 'row_wise', 'column_wise_snake', 'spiral'])
+def test_plan_grid_index_matches_the_mda_events(mode):
+    base = make_sequence(3, 4, 2)
+    sequence = MDASequence(
+        grid_plan={**base.grid_plan.model_dump(), 'mode': mode}, channels=base.channels, axis_order='gc'
+    )
+
+    grid_list, num_rows, num_cols = plan_grid_index(sequence.grid_plan.model_dump_json())
+    expected, expected_rows, expected_cols = walked_grid_index(sequence)
+
+    assert (num_rows, num_cols) == (expected_rows, expected_cols) == (3, 4)
+    np.testing.assert_array_equal(grid_list, expected)
+    assert not grid_list.flags.writeable
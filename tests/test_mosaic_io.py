@@ -0,0 +1,50 @@
+import numpy as np
+import zarr
+
+from fish_sorter.helpers.mosaic_io import MosaicWriter, mosaic_levels, open_mosaic, read_region, write_mosaic
+
+
+def _pyramid():
+    image = np.arange(300 * 500, dtype=np.uint16).reshape(300, 500)
+
+    return [image, image[::2, ::2], image[::4, ::4]]
+
+
+def test_write_and_read_back(tmp_path):
+    path = tmp_path / 'plate.ome.zarr'
+    pyramid = _pyramid()
+
+    write_mosaic(path, pyramid, pixel_size_um=0.5, chunks=(64, 128))
+
+    levels = mosaic_levels(path)
+    assert len(levels) == len(pyramid)
+    for level, expected in zip(levels, pyramid):
+        assert level.chunks == (64, 128)
+        np.testing.assert_array_equal(level[:], expected)
+    np.testing.assert_array_equal(open_mosaic(path, 1)[:], pyramid[1])
+    datasets = zarr.open_group(str(path), mode='r').attrs['multiscales'][0]['datasets']
+    assert [d['coordinateTransformations'][0]['scale'] for d in datasets] == [[0.5, 0.5], [1.0, 1.0], [2.0, 2.0]]
+
+
+def test_read_region_scales_the_bounds(tmp_path):
+    path = tmp_path / 'plate.ome.zarr'
+    pyramid = _pyramid()
+    write_mosaic(path, pyramid, chunks=(64, 64))
+
+    # x1 y1 x2 y2, partly outside of the mosaic
+    bounds = np.array([-20, 100, 180, 260])
+
+    np.testing.assert_array_equal(read_region(path, bounds), pyramid[0][100:260, 0:180])
+    np.testing.assert_array_equal(read_region(path, bounds, level=1), pyramid[1][50:130, 0:90])
+
+
+def test_writer_writes_in_the_background(tmp_path):
+    writer = MosaicWriter()
+    paths = [tmp_path / f'{i}.ome.zarr' for i in range(2)]
+    futures = [writer.submit(path, _pyramid()) for path in paths]
+    writer.wait()
+    writer.shutdown()
+
+    assert all(future.done() and future.exception() is None for future in futures)
+    for path in paths:
+        np.testing.assert_array_equal(open_mosaic(path, 2)[:], _pyramid()[2])
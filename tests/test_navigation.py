@@ -0,0 +1,48 @@
+from fish_sorter.helpers.navigation import NavigationIndex
+
+
+def test_next_and_previous_wrap_around():
+    index = NavigationIndex([3, 7, 12])
+
+    assert index.next(3) == 7
+    assert index.next(12) == 3
+    assert index.previous(7) == 3
+    assert index.previous(3) == 12
+
+
+def test_next_and_previous_from_wells_not_in_the_index():
+    index = NavigationIndex([3, 7, 12])
+
+    assert index.next(5) == 7
+    assert index.previous(5) == 3
+    assert index.next(20) == 3
+    assert index.previous(0) == 12
+
+
+def test_empty_index():
+    index = NavigationIndex()
+
+    assert index.next(0) is None
+    assert index.previous(0) is None
+    assert index.first() is None
+    assert len(index) == 0
+
+
+def test_add_discard_and_position():
+    index = NavigationIndex.from_mask([False, True, False, True])
+    index.add(2)
+    index.add(2)
+    index.discard(1)
+    index.discard(5)
+
+    assert list(index) == [2, 3]
+    assert index.position(3) == 1
+    assert index.position(1) == -1
+    assert 2 in index
+
+
+def test_update_follows_the_feature_values():
+    index = NavigationIndex([1, 2])
+    index.update([1, 4], [False, True])
+
+    assert list(index) == [2, 4]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from fish_sorter.helpers.registration import TileRegistration, phase_correlation, registration_key
+
+
+@pytest.mark.parametrize('dy, dx', [(0, 0), (3, 5), (-7, 2), (11, -9)])
+def test_phase_correlation_finds_integer_shift(dy, dx):
+    image = np.random.default_rng(0).normal(size=(200, 200)).astype(np.float32)
+    ref = image[50:178, 50:178]
+    mov = image[50 + dy : 178 + dy, 50 + dx : 178 + dx]
+
+    shift, confidence = phase_correlation(ref, mov)
+
+    # ref(y, x) matches mov(y - dy, x - dx)
+    np.testing.assert_allclose(shift, [dy, dx], atol=0.25)
+    assert 0 < confidence <= 1
+
+
+def test_uncorrelated_images_have_low_confidence():
+    rng = np.random.default_rng(1)
+    _, matched = phase_correlation(*[rng.normal(size=(128, 128))] * 2)
+    _, unmatched = phase_correlation(rng.normal(size=(128, 128)), rng.normal(size=(128, 128)))
+
+    assert unmatched < matched
+
+
+def _grid_tiles(seed):
+    # 2 x 2 tiles of 64 px cut from one image at a 48 px pitch
+    image = np.random.default_rng(seed).normal(size=(112, 112)).astype(np.float32)
+    y_starts, x_starts = np.meshgrid([0, 48], [0, 48], indexing='ij')
+
+    def get_tile(row, col):
+        return image[y_starts[row, col] : y_starts[row, col] + 64, x_starts[row, col] : x_starts[row, col] + 64]
+
+    return get_tile, y_starts, x_starts
+
+
+def test_register_recovers_nominal_grid(tmp_path):
+    get_tile, y_starts, x_starts = _grid_tiles(0)
+    registration = TileRegistration(cache_dir=tmp_path)
+
+    reg_y, reg_x = registration.register(get_tile, y_starts, x_starts, (64, 64), key='plate')
+
+    np.testing.assert_array_equal(reg_y, y_starts)
+    np.testing.assert_array_equal(reg_x, x_starts)
+    assert (tmp_path / 'plate.npz').exists()
+
+
+def test_changing_cache_dir_drops_cached_placements(tmp_path):
+    get_tile, y_starts, x_starts = _grid_tiles(0)
+    registration = TileRegistration(cache_dir=tmp_path / 'first')
+    registration.register(get_tile, y_starts, x_starts, (64, 64), key='plate')
+
+    registration.cache_dir = tmp_path / 'second'
+
+    assert registration._load('plate') is None
+
+
+def test_key_depends_on_tile_samples():
+    grid_list = np.zeros((2, 2, 3))
+    first = registration_key(grid_list, (5, 5), (64, 64), [np.zeros((4, 4))])
+    second = registration_key(grid_list, (5, 5), (64, 64), [np.ones((4, 4))])
+
+    assert first != second
+    assert first == registration_key(grid_list, (5, 5), (64, 64), [np.zeros((4, 4))])